@@ -3,19 +3,48 @@ from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
 from flask_jwt_extended import JWTManager, jwt_required, create_access_token, get_jwt_identity
 from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from collections import deque
 from datetime import datetime, timedelta
+import json
 import os
+import threading
+import time
 
 # Flask app setup for serverless
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'your-secret-key-here-change-in-production')
 
-# Use in-memory SQLite for serverless environment
-if os.environ.get('VERCEL_ENV'):
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
-else:
-    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', f'sqlite:///{os.path.abspath("betting_app.db")}')
+# Storage backend
+SERVERLESS_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 1))  # one request at a time per function instance
+SERVERLESS_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 2))
+SERVERLESS_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 300))  # seconds; outlive provider idle timeouts
+
+def storage_config():
+    """Database URL and engine options for the current deployment
     
+    An external DATABASE_URL is the persistent mode: its pooled, pre-pinged
+    connections survive between warm invocations. Without one, serverless
+    deployments fall back to a file in /tmp, which lasts as long as the instance.
+    """
+    database_url = os.environ.get('DATABASE_URL')
+    if database_url:
+        if database_url.startswith('postgres://'):
+            database_url = database_url.replace('postgres://', 'postgresql://', 1)
+        if database_url.startswith('sqlite'):
+            return database_url, {}
+        return database_url, {
+            'pool_size': SERVERLESS_POOL_SIZE,
+            'max_overflow': SERVERLESS_MAX_OVERFLOW,
+            'pool_recycle': SERVERLESS_POOL_RECYCLE,
+            'pool_pre_ping': True
+        }
+    if os.environ.get('VERCEL_ENV'):
+        return 'sqlite:////tmp/betting_app.db', {}
+    return f'sqlite:///{os.path.abspath("betting_app.db")}', {}
+
+app.config['SQLALCHEMY_DATABASE_URI'], app.config['SQLALCHEMY_ENGINE_OPTIONS'] = storage_config()
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['JWT_SECRET_KEY'] = os.environ.get('JWT_SECRET_KEY', 'jwt-secret-string-change-in-production')
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(days=7)
@@ -102,58 +131,323 @@ class MatkaMarket(db.Model):
             'is_active': self.is_active
         }
 
-# Initialize database on app startup
-with app.app_context():
-    try:
-        db.create_all()
-        print(f"Database created at: {app.config['SQLALCHEMY_DATABASE_URI']}")
-        
-        # Create default admin user if no users exist
-        user_count = User.query.count()
-        print(f"Current user count: {user_count}")
-        
-        if user_count == 0:
-            admin_user = User(username='admin', email='admin@example.com')
-            admin_user.set_password('admin123')
-            db.session.add(admin_user)
-            
-            # Create test user
-            test_user = User(username='test', email='test@example.com')
-            test_user.set_password('test123')
-            db.session.add(test_user)
-            
-            db.session.commit()
-            print("Created default users: admin/admin123 and test/test123")
-            
-            # Verify users were created
-            user_count_after = User.query.count()
-            print(f"User count after creation: {user_count_after}")
-        else:
-            print("Users already exist in database")
-            # Print existing users
-            users = User.query.all()
-            for user in users:
-                print(f"Existing user: {user.username}")
-        
-        if MatkaMarket.query.count() == 0:
-            markets = [
-                MatkaMarket(name='Kalyan', open_time='15:45', close_time='16:45', result_time='16:50'),
-                MatkaMarket(name='Milan Day', open_time='09:30', close_time='10:30', result_time='10:35'),
-                MatkaMarket(name='Milan Night', open_time='21:30', close_time='22:30', result_time='22:35'),
-                MatkaMarket(name='Rajdhani Day', open_time='13:40', close_time='14:40', result_time='14:45'),
-                MatkaMarket(name='Rajdhani Night', open_time='19:40', close_time='20:40', result_time='20:45'),
-                MatkaMarket(name='Time Bazar', open_time='10:30', close_time='11:30', result_time='11:35'),
-                MatkaMarket(name='Sridevi', open_time='11:30', close_time='12:30', result_time='12:35'),
-                MatkaMarket(name='Sridevi Night', open_time='20:30', close_time='21:30', result_time='21:35')
+class MarketStatCheckpoint(db.Model):
+    """Betting counters for one market and day, as last persisted by MarketStats"""
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False)
+    market = db.Column(db.String(200), nullable=False)
+    bet_count = db.Column(db.Integer, nullable=False, default=0)
+    stake = db.Column(db.Float, nullable=False, default=0.0)
+    players = db.Column(db.Text, nullable=False, default='[]')  # JSON list of user IDs
+    last_bet_id = db.Column(db.Integer, nullable=False, default=0)  # bets up to this ID are counted
+    
+    __table_args__ = (db.UniqueConstraint('day', 'market', name='uq_market_stat_day_market'),)
+
+class SchemaInfo(db.Model):
+    """Schema and seed version this database was last initialized to"""
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False)
+
+SCHEMA_VERSION = 2  # bump whenever a model or the default seed data changes
+
+# Market statistics
+STATS_REFRESH_SECONDS = 5  # how often bets placed through other instances are folded in
+STATS_CHECKPOINT_SECONDS = 60
+STATS_SETTLE_SECONDS = 60  # longest a bet transaction stays open after its ID is assigned
+TREND_WINDOW = timedelta(minutes=15)
+
+def market_key(name):
+    """Bets name their market in match_name; compare names case and spacing insensitively"""
+    return ' '.join(name.split()).upper()
+
+class MarketCounters:
+    """Running totals for one market, with bet counts for the current and previous trend window"""
+    
+    def __init__(self, players=(), bet_count=0, stake=0.0):
+        self.players = set(players)
+        self.bet_count = bet_count
+        self.stake = stake
+        self.window_start = None
+        self.current = 0
+        self.previous = 0
+    
+    def add(self, user_id, amount, at):
+        self.players.add(user_id)
+        self.bet_count += 1
+        self.stake += amount
+        self.roll(at)
+        self.current += 1
+    
+    def roll(self, now):
+        if self.window_start is None:
+            self.window_start = now
+            return
+        windows = (now - self.window_start) // TREND_WINDOW
+        if windows > 0:
+            self.previous = self.current if windows == 1 else 0
+            self.current = 0
+            self.window_start += windows * TREND_WINDOW
+    
+    @property
+    def trend(self):
+        if self.current > self.previous:
+            return 'up'
+        if self.current < self.previous:
+            return 'down'
+        return 'stable'
+
+class MarketStats:
+    """Today's per-market betting counters, kept in memory
+    
+    Bets placed through this instance are counted as they commit. Bets placed
+    elsewhere are folded in by reading only rows past a bet ID watermark, and
+    the counters are checkpointed so a cold start reads the checkpoint plus the
+    bets after it rather than the whole day. Bets can commit out of ID order on
+    Postgres, so the watermark only passes an ID STATS_SETTLE_SECONDS after a
+    catch-up first saw it, and the bets counted beyond it are remembered.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._day = None
+        self._markets = {}
+        self._players = set()
+        self._last_bet_id = 0  # every committed bet up to this ID is counted
+        self._counted = {}  # bet ID past the watermark -> (market, stake) it was counted under
+        self._seen = deque()  # (monotonic time, highest bet ID a catch-up saw then)
+        self._refreshed_at = 0.0
+        self._checkpointed_at = 0.0
+    
+    def record(self, bet):
+        """Count a bet this instance just committed; statistics never fail the bet"""
+        try:
+            self._sync()
+            with self._lock:
+                if bet.id > self._last_bet_id and bet.id not in self._counted:
+                    self._add(bet.id, bet.user_id, bet.match_name, bet.bet_amount, datetime.utcnow())
+        except Exception as e:
+            db.session.rollback()
+            print(f"Market stats update failed: {e}")
+    
+    def market(self, name):
+        """Players, bets, stake and trend for one market today"""
+        self._sync()
+        with self._lock:
+            counters = self._markets.get(market_key(name))
+            if counters is None:
+                return {'players': 0, 'bets': 0, 'stake': 0.0, 'trend': 'stable'}
+            return self._describe(counters)
+    
+    def summary(self, hot_count=3):
+        """Totals across markets and the markets with the most players"""
+        self._sync()
+        with self._lock:
+            now = datetime.utcnow()
+            for counters in self._markets.values():
+                counters.roll(now)
+            markets = sorted(self._markets.items(), key=lambda item: len(item[1].players), reverse=True)
+            return {
+                'players': len(self._players),
+                'bets': sum(counters.bet_count for counters in self._markets.values()),
+                'active': sum(counters.current for counters in self._markets.values()),
+                'hot': [dict(self._describe(counters), name=name) for name, counters in markets[:hot_count]]
+            }
+    
+    def _describe(self, counters):
+        counters.roll(datetime.utcnow())
+        return {
+            'players': len(counters.players),
+            'bets': counters.bet_count,
+            'stake': round(counters.stake, 2),
+            'trend': counters.trend
+        }
+    
+    def _add(self, bet_id, user_id, match_name, amount, at):
+        key = market_key(match_name)
+        counters = self._markets.get(key)
+        if counters is None:
+            counters = self._markets[key] = MarketCounters()
+        counters.add(user_id, amount, at)
+        self._players.add(user_id)
+        self._counted[bet_id] = (key, amount)
+    
+    def _sync(self):
+        """Load a new day or fold in other instances' bets when due, touching the database outside the lock"""
+        now = time.monotonic()
+        today = datetime.utcnow().date()
+        with self._lock:
+            new_day = self._day != today
+            if not new_day and now - self._refreshed_at < STATS_REFRESH_SECONDS:
+                return
+            self._refreshed_at = now  # other callers keep serving the current counters meanwhile
+            since = self._last_bet_id
+        
+        checkpoints = []
+        if new_day:
+            checkpoints = [
+                (row.market, json.loads(row.players), row.bet_count, row.stake, row.last_bet_id)
+                for row in MarketStatCheckpoint.query.filter_by(day=today).all()
             ]
-            for market in markets:
-                db.session.add(market)
+            since = max((last_bet_id for *_, last_bet_id in checkpoints), default=0)
+        started = time.monotonic()
+        rows = db.session.execute(
+            select(BetHistory.id, BetHistory.user_id, BetHistory.match_name,
+                   BetHistory.bet_amount, BetHistory.created_at)
+            .where(BetHistory.id > since,
+                   BetHistory.created_at >= datetime.combine(today, datetime.min.time()))
+            .order_by(BetHistory.id)
+        ).all()
+        
+        with self._lock:
+            if self._day is not None and self._day > today:
+                return  # the day rolled over while reading
+            loading = self._day != today  # unless another caller loaded it first
+            if loading:
+                self._load(today, checkpoints)
+            self._merge(rows, started)
+            if loading:
+                self._checkpointed_at = now if self._markets else 0.0  # just read back; nothing new to save
+            checkpoint = None
+            if now - self._checkpointed_at >= STATS_CHECKPOINT_SECONDS:
+                checkpoint = self._checkpoint_rows()
+                self._checkpointed_at = now
+        if checkpoint:
+            self._write_checkpoint(today, checkpoint)
+    
+    def _load(self, day, checkpoints):
+        self._day = day
+        self._markets = {}
+        self._players = set()
+        self._counted = {}
+        self._seen = deque()
+        self._last_bet_id = 0
+        for name, players, bet_count, stake, last_bet_id in checkpoints:
+            self._markets[name] = MarketCounters(players, bet_count, stake)
+            self._players.update(players)
+            self._last_bet_id = max(self._last_bet_id, last_bet_id)
+    
+    def _merge(self, rows, started):
+        """Fold in bets read at started, skipping those already counted"""
+        for row in rows:
+            if row.id > self._last_bet_id and row.id not in self._counted:
+                self._add(row.id, row.user_id, row.match_name, row.bet_amount, row.created_at)
+        if rows and (not self._seen or rows[-1].id > self._seen[-1][1]):
+            self._seen.append((started, rows[-1].id))
+        # Anything still uncommitted when an older catch-up ran has committed by now
+        while self._seen and started - self._seen[0][0] >= STATS_SETTLE_SECONDS:
+            self._last_bet_id = max(self._last_bet_id, self._seen.popleft()[1])
+        self._counted = {bet_id: counted for bet_id, counted in self._counted.items() if bet_id > self._last_bet_id}
+    
+    def _checkpoint_rows(self):
+        """Counters to persist, leaving out bets past the watermark since a reload reads those again"""
+        unsettled = {}
+        for key, amount in self._counted.values():
+            count, stake = unsettled.get(key, (0, 0.0))
+            unsettled[key] = (count + 1, stake + amount)
+        rows = []
+        for name, counters in self._markets.items():
+            count, stake = unsettled.get(name, (0, 0.0))
+            # Re-adding a player on reload is harmless, so players need no adjusting
+            rows.append((name, counters.bet_count - count, counters.stake - stake,
+                         json.dumps(sorted(counters.players)), self._last_bet_id))
+        return rows
+    
+    def _write_checkpoint(self, day, checkpoint):
+        existing = {row.market: row for row in MarketStatCheckpoint.query.filter_by(day=day).all()}
+        for name, bet_count, stake, players, last_bet_id in checkpoint:
+            row = existing.get(name) or MarketStatCheckpoint(day=day, market=name)
+            row.bet_count = bet_count
+            row.stake = stake
+            row.players = players
+            row.last_bet_id = last_bet_id
+            db.session.add(row)
+        try:
             db.session.commit()
-            print("Created default markets")
-    except Exception as e:
-        print(f"Database init error: {e}")
-        import traceback
-        traceback.print_exc()
+        except IntegrityError:
+            db.session.rollback()  # another instance checkpointed the same day first
+
+market_stats = MarketStats()
+
+# Database initialization
+def init_db():
+    """Create tables and seed default users and markets; safe to run repeatedly"""
+    db.create_all()
+    
+    # Create default admin and test users if no users exist
+    if User.query.count() == 0:
+        admin_user = User(username='admin', email='admin@example.com')
+        admin_user.set_password('admin123')
+        db.session.add(admin_user)
+        
+        test_user = User(username='test', email='test@example.com')
+        test_user.set_password('test123')
+        db.session.add(test_user)
+        
+        db.session.commit()
+        print("Created default users: admin/admin123 and test/test123")
+    
+    # Create demo user if not exists
+    if not User.query.filter_by(username='demo').first():
+        demo_user = User(username='demo', email='demo@example.com')
+        demo_user.set_password('demo123')
+        db.session.add(demo_user)
+        db.session.commit()
+        print("Demo user created successfully")
+    
+    if MatkaMarket.query.count() == 0:
+        markets = [
+            MatkaMarket(name='Kalyan', open_time='15:45', close_time='16:45', result_time='16:50'),
+            MatkaMarket(name='Milan Day', open_time='09:30', close_time='10:30', result_time='10:35'),
+            MatkaMarket(name='Milan Night', open_time='21:30', close_time='22:30', result_time='22:35'),
+            MatkaMarket(name='Rajdhani Day', open_time='13:40', close_time='14:40', result_time='14:45'),
+            MatkaMarket(name='Rajdhani Night', open_time='19:40', close_time='20:40', result_time='20:45'),
+            MatkaMarket(name='Time Bazar', open_time='10:30', close_time='11:30', result_time='11:35'),
+            MatkaMarket(name='Sridevi', open_time='11:30', close_time='12:30', result_time='12:35'),
+            MatkaMarket(name='Sridevi Night', open_time='20:30', close_time='21:30', result_time='21:35')
+        ]
+        for market in markets:
+            db.session.add(market)
+        db.session.commit()
+        print("Created default markets")
+    
+    db.session.merge(SchemaInfo(id=1, version=SCHEMA_VERSION))
+    db.session.commit()
+
+def schema_current():
+    """One primary-key read telling whether init_db already ran against this database"""
+    try:
+        info = db.session.get(SchemaInfo, 1)
+    except Exception:
+        db.session.rollback()  # table missing on a fresh database
+        return False
+    return info is not None and info.version >= SCHEMA_VERSION
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Create and seed the database ahead of the first request"""
+    init_db()
+    print(f"Database ready at: {app.config['SQLALCHEMY_DATABASE_URI']}")
+
+_ready = False
+_ready_lock = threading.Lock()
+
+@app.before_request
+def ensure_ready():
+    """Initialize the database once per process, on the first request"""
+    global _ready
+    if _ready:
+        return
+    with _ready_lock:
+        if not _ready:
+            try:
+                if not schema_current():
+                    init_db()
+                _ready = True
+            except Exception as e:
+                db.session.rollback()
+                print(f"Database init error: {e}")
+                import traceback
+                traceback.print_exc()
 
 # Routes
 @app.route('/', methods=['GET'])
@@ -288,6 +582,7 @@ def place_bet():
         
         db.session.add(bet)
         db.session.commit()
+        market_stats.record(bet)
         
         return jsonify({
             'message': 'Bet placed successfully',
@@ -320,7 +615,6 @@ def get_matka_markets():
                 'resultTime': '16:50',
                 'icon': '🏆',
                 'color': '#4CAF50',
-                'players': random.randint(2000, 3000),
                 'todayResult': f'{random.randint(100, 999)}-{random.randint(10, 99)}' if now.hour >= 16 else 'XXX-XX',
                 'yesterdayResult': f'{random.randint(100, 999)}-{random.randint(10, 99)}'
             },
@@ -332,7 +626,6 @@ def get_matka_markets():
                 'resultTime': '11:35',
                 'icon': '💎',
                 'color': '#2196F3',
-                'players': random.randint(1500, 2500),
                 'todayResult': f'{random.randint(100, 999)}-{random.randint(10, 99)}' if now.hour >= 11 else 'XXX-XX',
                 'yesterdayResult': f'{random.randint(100, 999)}-{random.randint(10, 99)}'
             },
@@ -344,7 +637,6 @@ def get_matka_markets():
                 'resultTime': '22:35',
                 'icon': '🌙',
                 'color': '#9C27B0',
-                'players': random.randint(2500, 4000),
                 'todayResult': f'{random.randint(100, 999)}-{random.randint(10, 99)}' if now.hour >= 22 else 'XXX-XX',
                 'yesterdayResult': f'{random.randint(100, 999)}-{random.randint(10, 99)}'
             },
@@ -356,7 +648,6 @@ def get_matka_markets():
                 'resultTime': '14:45',
                 'icon': '👑',
                 'color': '#FF9800',
-                'players': random.randint(1200, 2000),
                 'todayResult': f'{random.randint(100, 999)}-{random.randint(10, 99)}' if now.hour >= 14 else 'XXX-XX',
                 'yesterdayResult': f'{random.randint(100, 999)}-{random.randint(10, 99)}'
             },
@@ -368,7 +659,6 @@ def get_matka_markets():
                 'resultTime': '20:45',
                 'icon': '🌟',
                 'color': '#E91E63',
-                'players': random.randint(2000, 3500),
                 'todayResult': f'{random.randint(100, 999)}-{random.randint(10, 99)}' if now.hour >= 20 else 'XXX-XX',
                 'yesterdayResult': f'{random.randint(100, 999)}-{random.randint(10, 99)}'
             },
@@ -380,7 +670,6 @@ def get_matka_markets():
                 'resultTime': '11:35',
                 'icon': '⏰',
                 'color': '#607D8B',
-                'players': random.randint(1000, 1800),
                 'todayResult': f'{random.randint(100, 999)}-{random.randint(10, 99)}' if now.hour >= 11 else 'XXX-XX',
                 'yesterdayResult': f'{random.randint(100, 999)}-{random.randint(10, 99)}'
             },
@@ -392,7 +681,6 @@ def get_matka_markets():
                 'resultTime': '13:05',
                 'icon': '🍯',
                 'color': '#FF5722',
-                'players': random.randint(1500, 2300),
                 'todayResult': f'{random.randint(100, 999)}-{random.randint(10, 99)}' if now.hour >= 13 else 'XXX-XX',
                 'yesterdayResult': f'{random.randint(100, 999)}-{random.randint(10, 99)}'
             },
@@ -404,7 +692,6 @@ def get_matka_markets():
                 'resultTime': '22:00',
                 'icon': '🌃',
                 'color': '#795548',
-                'players': random.randint(1800, 2800),
                 'todayResult': f'{random.randint(100, 999)}-{random.randint(10, 99)}' if now.hour >= 22 else 'XXX-XX',
                 'yesterdayResult': f'{random.randint(100, 999)}-{random.randint(10, 99)}'
             }
@@ -412,6 +699,7 @@ def get_matka_markets():
         
         # Update market status based on current time
         for market in markets:
+            market['players'] = market_stats.market(market['name'])['players']
             open_time = datetime.strptime(market['openTime'], '%H:%M').time()
             close_time = datetime.strptime(market['closeTime'], '%H:%M').time()
             result_time = datetime.strptime(market['resultTime'], '%H:%M').time()
@@ -469,17 +757,16 @@ def get_live_data():
         return make_response('', 200)
     
     try:
-        import random
+        stats = market_stats.summary()
         
         live_data = {
-            'totalPlayers': random.randint(15000, 25000),
-            'totalBetsToday': random.randint(50000, 100000),
-            'activeBetting': random.randint(500, 1500),
+            'totalPlayers': stats['players'],
+            'totalBetsToday': stats['bets'],
+            'activeBetting': stats['active'],  # bets in the current trend window
             'lastUpdate': datetime.now().isoformat(),
             'hotMarkets': [
-                {'name': 'KALYAN', 'players': random.randint(2000, 3000), 'trend': 'up'},
-                {'name': 'MILAN NIGHT', 'players': random.randint(2500, 4000), 'trend': 'up'},
-                {'name': 'RAJDHANI NIGHT', 'players': random.randint(2000, 3500), 'trend': 'stable'}
+                {'name': market['name'], 'players': market['players'], 'trend': market['trend']}
+                for market in stats['hot']
             ]
         }
         
@@ -488,25 +775,6 @@ def get_live_data():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-# Initialize database and default data
-def init_db():
-    """Initialize database and create default data"""
-    try:
-        db.create_all()
-        # Create demo user if not exists
-        if not User.query.filter_by(username='demo').first():
-            demo_user = User(username='demo', email='demo@example.com')
-            demo_user.set_password('demo123')
-            db.session.add(demo_user)
-            db.session.commit()
-            print("Demo user created successfully")
-    except Exception as e:
-        print(f"Database initialization error: {e}")
-
-# Initialize database when app starts
-with app.app_context():
-    init_db()
-
 # For local testing
 if __name__ == '__main__':
     with app.app_context():
@@ -9,7 +9,12 @@ import os
 # Flask app setup
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-here-change-in-production'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:////tmp/betting_app.db'  # Use /tmp for serverless
+database_url = os.environ.get('DATABASE_URL', 'sqlite:////tmp/betting_app.db')  # /tmp when no external database
+if database_url.startswith('postgres://'):
+    database_url = database_url.replace('postgres://', 'postgresql://', 1)  # Heroku/Render style; SQLAlchemy wants postgresql://
+app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+if os.environ.get('DATABASE_URL'):
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'pool_pre_ping': True, 'pool_recycle': 300}
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['JWT_SECRET_KEY'] = 'jwt-secret-string-change-in-production'
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(days=7)
@@ -1,20 +1,131 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, make_response, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
-from flask_jwt_extended import JWTManager, jwt_required, create_access_token, get_jwt_identity
+from flask_jwt_extended import JWTManager, jwt_required, create_access_token, current_user, get_jwt_identity
 from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime, timedelta
+from sqlalchemy import Integer, and_, case, cast, event, exists, func, insert, inspect, literal, select, text, tuple_, update
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import object_session
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+from functools import lru_cache, wraps
+import base64
+import click
+import csv
+import hmac
+import io
+import json
 import os
+import queue
+import sqlite3
+import threading
+import time
+import zlib
+
+try:
+    import orjson
+except ImportError:  # optional; responses fall back to the stdlib json provider
+    orjson = None
 
 # Flask app setup
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'your-secret-key-here-change-in-production')
 database_url = os.environ.get('DATABASE_URL', 'sqlite:///betting_app.db')
-# For now, use SQLite to avoid PostgreSQL issues
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///betting_app.db'
+if database_url.startswith('postgres://'):
+    # Heroku/Render style URLs use a scheme SQLAlchemy no longer accepts
+    database_url = database_url.replace('postgres://', 'postgresql://', 1)
+app.config['SQLALCHEMY_DATABASE_URI'] = database_url
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['JWT_SECRET_KEY'] = os.environ.get('JWT_SECRET_KEY', 'fallback-jwt-secret-key-change-in-production-12345')
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(days=7)
+app.config['EXPORT_API_KEY'] = os.environ.get('EXPORT_API_KEY')  # operator endpoints (exports, exposure) are off when unset
+
+# Storage tuning
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 20))
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))  # seconds
+
+def _engine_options(url):
+    if url.startswith('sqlite'):
+        if ':memory:' in url or url == 'sqlite://':
+            return {}  # a single shared connection; pooling would lose the database
+        return {
+            'pool_size': DB_POOL_SIZE,
+            'max_overflow': DB_MAX_OVERFLOW,
+            'connect_args': {'timeout': SQLITE_BUSY_TIMEOUT_MS / 1000}
+        }
+    return {
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': True
+    }
+
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = _engine_options(database_url)
+
+@event.listens_for(Engine, 'connect')
+def _configure_sqlite(dbapi_connection, connection_record):
+    """Let readers and writers run concurrently and shorten each commit's fsync"""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute(f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}')
+    cursor.execute(f'PRAGMA mmap_size={SQLITE_MMAP_SIZE}')
+    cursor.close()
+
+# Password hashing
+# Werkzeug method string, e.g. "pbkdf2:sha256:600000" or "scrypt:32768:8:1"
+PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000')
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+
+# Hashing is CPU bound; capping its threads keeps login spikes from starving other requests
+_password_pool = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix='password-hash')
+
+def _hash_parameters(method):
+    """Spell out the defaults Werkzeug fills in, so stored and configured methods compare equal"""
+    name, *args = method.split(':')
+    if name == 'scrypt':
+        defaults = ['32768', '8', '1']
+    elif name == 'pbkdf2':
+        defaults = ['sha256', '600000']
+    else:
+        return method
+    return ':'.join([name] + args + defaults[len(args):])
+
+PASSWORD_HASH_PARAMETERS = _hash_parameters(PASSWORD_HASH_METHOD)
+
+# JSON serialization
+class ORJSONProvider(DefaultJSONProvider):
+    """Serialize responses with orjson, deferring to the default provider for types or options it can't handle"""
+    
+    def dumps(self, obj, **kwargs):
+        # orjson only indents by two spaces and always writes compact separators
+        if set(kwargs) - {'sort_keys', 'indent', 'separators'} or kwargs.get('indent') not in (None, 2) \
+                or kwargs.get('separators') not in (None, (',', ':')):
+            return super().dumps(obj, **kwargs)
+        option = orjson.OPT_NON_STR_KEYS
+        if kwargs.get('sort_keys', self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        if kwargs.get('indent'):
+            option |= orjson.OPT_INDENT_2
+        try:
+            return orjson.dumps(obj, option=option).decode()
+        except TypeError:
+            return super().dumps(obj, **kwargs)
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+JSON_PROVIDER = os.environ.get('JSON_PROVIDER', 'orjson' if orjson else 'default')
+if JSON_PROVIDER == 'orjson':
+    app.json = ORJSONProvider(app)
 
 # Initialize extensions
 db = SQLAlchemy(app)
@@ -26,15 +137,21 @@ class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
-    password_hash = db.Column(db.String(128), nullable=False)
+    password_hash = db.Column(db.String(256), nullable=False)  # scrypt hashes run past 128
     balance = db.Column(db.Float, default=1000.0)  # Starting balance
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = _password_pool.submit(
+            generate_password_hash, password, PASSWORD_HASH_METHOD
+        ).result()
     
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return _password_pool.submit(check_password_hash, self.password_hash, password).result()
+    
+    def password_needs_rehash(self):
+        """Whether the stored hash was made with a different method or cost than configured"""
+        return self.password_hash.split('$', 1)[0] != PASSWORD_HASH_PARAMETERS
     
     def to_dict(self):
         return {
@@ -55,6 +172,10 @@ class BetHistory(db.Model):
     status = db.Column(db.String(20), default='pending')  # 'pending', 'won', 'lost'
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    __table_args__ = (
+        db.Index('ix_bet_history_user_created', 'user_id', 'created_at', 'id'),
+    )
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -66,6 +187,11 @@ class BetHistory(db.Model):
             'created_at': self.created_at.isoformat()
         }
 
+@lru_cache(maxsize=None)
+def _parse_clock(value):
+    """Parse an "HH:MM" market time once per distinct value"""
+    return datetime.strptime(value, "%H:%M").time()
+
 # Matka Game Models
 class MatkaMarket(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -87,11 +213,10 @@ class MatkaMarket(db.Model):
             'status': self.get_current_status()
         }
     
-    def get_current_status(self):
-        from datetime import datetime
-        now = datetime.now().time()
-        open_time = datetime.strptime(self.open_time, "%H:%M").time()
-        close_time = datetime.strptime(self.close_time, "%H:%M").time()
+    def get_current_status(self, now=None):
+        now = now or datetime.now().time()
+        open_time = _parse_clock(self.open_time)
+        close_time = _parse_clock(self.close_time)
         
         if now < open_time:
             return 'not_started'
@@ -112,6 +237,11 @@ class MatkaResult(db.Model):
     declared_at = db.Column(db.DateTime)
     is_declared = db.Column(db.Boolean, default=False)
     
+    __table_args__ = (
+        db.Index('uq_matka_result_market_date', 'market_id', 'date', unique=True),
+        db.Index('ix_matka_result_date', 'date'),
+    )
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -131,7 +261,7 @@ class MatkaBet(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     market_id = db.Column(db.Integer, db.ForeignKey('matka_market.id'), nullable=False)
     bet_type = db.Column(db.String(20), nullable=False)  # single, jodi, panna, sangam
-    numbers = db.Column(db.String(100), nullable=False)  # "1,2,3" or "12,23,34"
+    numbers = db.Column(db.String(100), nullable=False)  # canonical: "1,2,3", "12,23", "6-190"
     amount = db.Column(db.Float, nullable=False)
     rate = db.Column(db.Float, nullable=False)  # Payout rate (9.5 for single, 95 for jodi)
     date = db.Column(db.Date, nullable=False)
@@ -140,6 +270,11 @@ class MatkaBet(db.Model):
     win_amount = db.Column(db.Float, default=0.0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    __table_args__ = (
+        db.Index('ix_matka_bet_settlement', 'market_id', 'date', 'status'),
+        db.Index('ix_matka_bet_user_created', 'user_id', 'created_at'),
+    )
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -155,6 +290,535 @@ class MatkaBet(db.Model):
             'created_at': self.created_at.isoformat()
         }
 
+class MatkaBetCode(db.Model):
+    """Integer code for one number of a MatkaBet, written at placement"""
+    id = db.Column(db.Integer, primary_key=True)
+    bet_id = db.Column(db.Integer, db.ForeignKey('matka_bet.id'), nullable=False)
+    market_id = db.Column(db.Integer, db.ForeignKey('matka_market.id'), nullable=False)
+    date = db.Column(db.Date, nullable=False)
+    code = db.Column(db.Integer, nullable=False)  # see _bet_code
+    
+    __table_args__ = (
+        db.Index('ix_matka_bet_code_lookup', 'market_id', 'date', 'code'),
+    )
+
+class WalletLedger(db.Model):
+    """Append-only record of every balance change, in minor units (paise)"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    amount_minor = db.Column(db.Integer, nullable=False)  # negative for debits
+    kind = db.Column(db.String(20), nullable=False)  # 'opening', 'bet', 'matka_bet', 'win'
+    ref_id = db.Column(db.Integer)  # BetHistory or MatkaBet id
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_wallet_ledger_user', 'user_id', 'id'),
+    )
+
+class WalletSnapshot(db.Model):
+    """Ledger total for a user up to and including ledger_id"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    ledger_id = db.Column(db.Integer, nullable=False)
+    balance_minor = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_wallet_snapshot_user', 'user_id', 'ledger_id'),
+    )
+
+class DataVersion(db.Model):
+    """Single-row counter bumped whenever public market or result data changes"""
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class SchemaInfo(db.Model):
+    """Schema version this database was last migrated to"""
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False)
+
+SCHEMA_VERSION = 3  # bump whenever a model gains a table, column or index
+
+def _column_rows(model):
+    """Select a model's columns as plain rows, skipping ORM object hydration
+    
+    The to_dict methods only read attributes, so Model.to_dict(row) works on these rows.
+    """
+    return select(*model.__table__.columns)
+
+# Bet numbers
+# Every number a bet covers is stored as one integer code,
+#   bet type * 10**7 + variant * 10**6 + value
+# where the variant is the session (0 open, 1 close) for single and panna bets,
+# the half sangam form (0 open ank with close panna, 1 open panna with close ank),
+# and 0 otherwise. Settlement and limits then compare integers only.
+BET_TYPE_CODES = {
+    'single': 1,
+    'jodi': 2,
+    'single_panna': 3,
+    'double_panna': 4,
+    'triple_panna': 5,
+    'half_sangam': 6,
+    'full_sangam': 7
+}
+BET_TYPE_NAMES = {code: name for name, code in BET_TYPE_CODES.items()}
+SESSION_BET_TYPES = ('single', 'single_panna', 'double_panna', 'triple_panna')
+PANNA_BET_TYPES = ('single_panna', 'double_panna', 'triple_panna')
+MAX_NUMBERS_LENGTH = 100  # MatkaBet.numbers column size
+
+def _bet_code(bet_type, variant, value):
+    return BET_TYPE_CODES[bet_type] * 10_000_000 + variant * 1_000_000 + value
+
+def _describe_bet_code(code):
+    """Readable form of a bet code, such as single:open:6 or half_sangam:6-190"""
+    bet_type = BET_TYPE_NAMES[code // 10_000_000]
+    variant, value = divmod(code % 10_000_000, 1_000_000)
+    if bet_type == 'single':
+        return f'single:{BET_SESSIONS[variant]}:{value}'
+    if bet_type in PANNA_BET_TYPES:
+        return f'{bet_type}:{BET_SESSIONS[variant]}:{value:03d}'
+    if bet_type == 'jodi':
+        return f'jodi:{value:02d}'
+    if bet_type == 'half_sangam' and variant == 0:
+        return 'half_sangam:%d-%03d' % divmod(value, 1000)
+    if bet_type == 'half_sangam':
+        return 'half_sangam:%03d-%d' % divmod(value, 10)
+    return 'full_sangam:%03d-%03d' % divmod(value, 1000)
+
+def _digits(token, length):
+    if len(token) != length or not (token.isascii() and token.isdigit()):
+        raise ValueError()
+    return token
+
+def _canonical_panna(value):
+    """Order a panna's digits as charts list them, with 0 ranking as 10 ("019" -> "190")"""
+    if not isinstance(value, str):
+        raise ValueError('Invalid panna')
+    return ''.join(sorted(_digits(value, 3), key=lambda digit: int(digit) or 10))
+
+def _panna_type(pana):
+    """Classify a pana by its repeated digits"""
+    return {3: 'single_panna', 2: 'double_panna', 1: 'triple_panna'}[len(set(pana))]
+
+def _parse_number(bet_type, token, session):
+    """Canonical form and code of one number, raising ValueError when it is illegal"""
+    variant = BET_SESSIONS.index(session) if bet_type in SESSION_BET_TYPES else 0
+    if bet_type == 'single':
+        return token, _bet_code(bet_type, variant, int(_digits(token, 1)))
+    if bet_type == 'jodi':
+        return token, _bet_code(bet_type, variant, int(_digits(token, 2)))
+    if bet_type in PANNA_BET_TYPES:
+        panna = _canonical_panna(token)
+        if _panna_type(panna) != bet_type:
+            raise ValueError()
+        return panna, _bet_code(bet_type, variant, int(panna))
+    
+    left, separator, right = token.partition('-')
+    if not separator:
+        raise ValueError()
+    if bet_type == 'half_sangam' and len(left) == 1:
+        ank, panna = _digits(left, 1), _canonical_panna(right)
+        return f'{ank}-{panna}', _bet_code(bet_type, 0, int(ank) * 1000 + int(panna))
+    if bet_type == 'half_sangam':
+        panna, ank = _canonical_panna(left), _digits(right, 1)
+        return f'{panna}-{ank}', _bet_code(bet_type, 1, int(panna) * 10 + int(ank))
+    open_panna, close_panna = _canonical_panna(left), _canonical_panna(right)
+    return f'{open_panna}-{close_panna}', _bet_code(bet_type, 0, int(open_panna) * 1000 + int(close_panna))
+
+def _parse_numbers(bet_type, numbers, session):
+    """Validate a bet's comma separated numbers, returning (canonical numbers, codes)
+    
+    Raises ValueError with a message for the client when any number is illegal.
+    """
+    if not isinstance(bet_type, str) or bet_type not in BET_TYPE_CODES:
+        raise ValueError('Invalid bet type')
+    tokens = [token.strip() for token in str(numbers if numbers is not None else '').split(',') if token.strip()]
+    if not tokens:
+        raise ValueError('No numbers given')
+    
+    canonical, codes = [], []
+    for token in tokens:
+        try:
+            number, code = _parse_number(bet_type, token, session)
+        except ValueError:
+            raise ValueError(f'Invalid number {token} for {bet_type}') from None
+        if code not in codes:
+            canonical.append(number)
+            codes.append(code)
+    
+    numbers = ','.join(canonical)
+    if len(numbers) > MAX_NUMBERS_LENGTH:
+        raise ValueError('Too many numbers in one bet')
+    return numbers, codes
+
+def _winning_codes(open_pana, close_pana, open_ank, close_ank):
+    """Every bet code that wins for a declared result with canonical pannas"""
+    return {
+        _bet_code('single', 0, open_ank),
+        _bet_code('single', 1, close_ank),
+        _bet_code('jodi', 0, open_ank * 10 + close_ank),
+        _bet_code(_panna_type(open_pana), 0, int(open_pana)),
+        _bet_code(_panna_type(close_pana), 1, int(close_pana)),
+        _bet_code('half_sangam', 0, open_ank * 1000 + int(close_pana)),
+        _bet_code('half_sangam', 1, int(open_pana) * 10 + close_ank),
+        _bet_code('full_sangam', 0, int(open_pana) * 1000 + int(close_pana))
+    }
+
+def _add_bet_codes(bet, codes):
+    """Index a flushed bet under the codes _parse_numbers gave for it"""
+    for code in codes:
+        db.session.add(MatkaBetCode(bet_id=bet.id, market_id=bet.market_id, date=bet.date, code=code))
+
+# Market schedule
+BET_SESSIONS = ('open', 'close')
+MARKET_SCHEDULE_TTL = timedelta(seconds=60)  # picks up edits made by other workers
+
+class MarketSchedule:
+    """In-memory active market list, rebuilt only when a market status can change"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._markets = None
+        self._hours = {}  # market id -> (open time, close time)
+        self._expires_at = None
+        self._status_stamp = None
+        self._status_since = None
+    
+    @property
+    def expires_at(self):
+        return self._expires_at
+    
+    def invalidate(self):
+        with self._lock:
+            self._markets = None
+    
+    def accepts_bets(self, market_id, session, now=None):
+        """Whether a market session takes bets right now, answered from memory"""
+        self.markets()
+        hours = self._hours.get(market_id)
+        now = now or datetime.now().time()
+        # Same window get_current_status reports as 'open'
+        return hours is not None and session in BET_SESSIONS and hours[0] <= now < hours[1]
+    
+    def markets(self):
+        """Serialized active markets with their current status"""
+        now = datetime.now()
+        with self._lock:
+            if self._markets is None or now >= self._expires_at:
+                self._load(now)
+            return self._markets
+    
+    @property
+    def status_stamp(self):
+        """Changes whenever any market status changes"""
+        return self._status_stamp
+    
+    @property
+    def status_since(self):
+        """When the current statuses took effect, in UTC"""
+        return self._status_since
+    
+    def _load(self, now):
+        markets = MatkaMarket.query.filter_by(is_active=True).all()
+        self._markets = [market.to_dict() for market in markets]
+        self._hours = {
+            market.id: (_parse_clock(market.open_time), _parse_clock(market.close_time))
+            for market in markets
+        }
+        self._status_stamp = zlib.crc32(
+            ','.join(f"{market['id']}:{market['status']}" for market in self._markets).encode()
+        )
+        
+        boundaries = self._boundaries(markets, now)
+        self._status_since = max(b for b in boundaries if b <= now).astimezone(timezone.utc)
+        self._expires_at = min(min(b for b in boundaries if b > now), now + MARKET_SCHEDULE_TTL)
+    
+    @staticmethod
+    def _boundaries(markets, now):
+        """Today's open and close times, plus the midnights when statuses reset"""
+        midnight = datetime.combine(now.date(), datetime.min.time())
+        return [midnight, midnight + timedelta(days=1)] + [
+            datetime.combine(now.date(), _parse_clock(value))
+            for market in markets
+            for value in (market.open_time, market.close_time)
+        ]
+
+market_schedule = MarketSchedule()
+
+@event.listens_for(MatkaMarket, 'after_insert')
+@event.listens_for(MatkaMarket, 'after_update')
+@event.listens_for(MatkaMarket, 'after_delete')
+def _mark_markets_changed(mapper, connection, target):
+    object_session(target).info['markets_changed'] = True
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_market_schedule(session):
+    if session.info.pop('markets_changed', False):
+        market_schedule.invalidate()
+
+# Conditional GET for public market and result data
+@event.listens_for(MatkaMarket, 'after_insert')
+@event.listens_for(MatkaMarket, 'after_update')
+@event.listens_for(MatkaMarket, 'after_delete')
+@event.listens_for(MatkaResult, 'after_insert')
+@event.listens_for(MatkaResult, 'after_update')
+@event.listens_for(MatkaResult, 'after_delete')
+def _bump_data_version(mapper, connection, target):
+    connection.execute(
+        update(DataVersion)
+        .where(DataVersion.id == 1)
+        .values(version=DataVersion.version + 1, updated_at=datetime.utcnow())
+    )
+
+def _ensure_data_version():
+    if not db.session.get(DataVersion, 1):
+        db.session.add(DataVersion(id=1))
+        db.session.commit()
+
+def conditional_public(view):
+    """Answer polls of unchanged market/result data with 304 Not Modified"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        data_version = db.session.get(DataVersion, 1) or DataVersion(version=0, updated_at=datetime(1970, 1, 1))
+        market_schedule.markets()
+        etag = f'{data_version.version}-{market_schedule.status_stamp}-{date.today():%Y%m%d}'
+        last_modified = max(
+            data_version.updated_at.replace(tzinfo=timezone.utc, microsecond=0),
+            market_schedule.status_since.replace(microsecond=0)
+        )
+        
+        if request.if_none_match:
+            unchanged = request.if_none_match.contains(etag)
+        else:
+            unchanged = request.if_modified_since is not None and last_modified <= request.if_modified_since
+        
+        response = Response(status=304) if unchanged else make_response(view(*args, **kwargs))
+        if response.status_code in (200, 304):
+            response.set_etag(etag)
+            response.last_modified = last_modified
+            response.cache_control.no_cache = True
+        return response
+    return wrapper
+
+# Live feed
+LIVE_KEEPALIVE = 15  # seconds between SSE comments on an idle stream
+LIVE_QUEUE_SIZE = 100  # events buffered per subscriber before dropping
+
+class LiveBroker:
+    """In-process fan-out of live events to Server-Sent Event subscribers"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+    
+    def subscribe(self):
+        subscriber = queue.Queue(maxsize=LIVE_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+    
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+    
+    def publish(self, event, data):
+        message = _sse_message(event, data)
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(message)
+            except queue.Full:
+                pass  # slow client; it resyncs from the snapshot on reconnect
+
+def _sse_message(event, data):
+    return f"event: {event}\ndata: {app.json.dumps(data)}\n\n"
+
+live_broker = LiveBroker()
+
+_status_publisher = None
+_status_publisher_lock = threading.Lock()
+
+def _publish_status_changes():
+    """Wake at each schedule boundary and broadcast markets whose status flipped"""
+    statuses = None
+    while True:
+        try:
+            with app.app_context():
+                markets = market_schedule.markets()
+                wake_at = market_schedule.expires_at
+            current = {market['id']: market['status'] for market in markets}
+            if statuses is not None:
+                for market in markets:
+                    if statuses.get(market['id']) != market['status']:
+                        live_broker.publish('market_status', market)
+            statuses = current
+            time.sleep(max((wake_at - datetime.now()).total_seconds(), 0) + 0.1)
+        except Exception as e:
+            print(f"Market status publisher error: {e}")
+            time.sleep(LIVE_KEEPALIVE)
+
+def _ensure_status_publisher():
+    global _status_publisher
+    with _status_publisher_lock:
+        if _status_publisher is None:
+            _status_publisher = threading.Thread(target=_publish_status_changes, daemon=True)
+            _status_publisher.start()
+
+# Wallet
+WALLET_BUSY_RETRIES = 5
+WALLET_BUSY_BACKOFF = 0.01  # seconds, doubled per retry
+WALLET_SETTLE_SECONDS = 60  # longest a ledger write stays uncommitted after its ID is assigned
+
+class InsufficientBalance(Exception):
+    pass
+
+def _to_minor(amount):
+    return int(round(amount * 100))
+
+def _record_ledger(user_id, amount, kind, ref_id=None):
+    db.session.add(WalletLedger(user_id=user_id, amount_minor=_to_minor(amount), kind=kind, ref_id=ref_id))
+
+def _open_wallet(user):
+    """Record the starting balance of a flushed user"""
+    _record_ledger(user.id, user.balance, 'opening')
+
+def _debit_wallet(user_id, amount):
+    """Debit a balance in one conditional UPDATE and return the new balance"""
+    result = db.session.execute(
+        update(User)
+        .where(User.id == user_id, User.balance >= amount)
+        .values(balance=User.balance - amount)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != 1:
+        raise InsufficientBalance()
+    _mark_balance_changed(user_id)
+    return db.session.execute(select(User.balance).where(User.id == user_id)).scalar_one()
+
+def _is_busy_error(error):
+    message = str(error.orig).lower()
+    return 'database is locked' in message or 'database is busy' in message
+
+def _with_busy_retry(operation):
+    """Run a write transaction, retrying it when SQLite reports a busy database"""
+    for attempt in range(WALLET_BUSY_RETRIES):
+        try:
+            return operation()
+        except OperationalError as e:
+            db.session.rollback()
+            if not _is_busy_error(e) or attempt == WALLET_BUSY_RETRIES - 1:
+                raise
+            time.sleep(WALLET_BUSY_BACKOFF * 2 ** attempt)
+
+def _ledger_balance_minor(user_id):
+    """Balance from the latest snapshot plus the ledger entries after it"""
+    snapshot = WalletSnapshot.query.filter_by(user_id=user_id)\
+        .order_by(WalletSnapshot.ledger_id.desc()).first()
+    since = snapshot.ledger_id if snapshot else 0
+    delta = db.session.execute(
+        select(func.coalesce(func.sum(WalletLedger.amount_minor), 0))
+        .where(WalletLedger.user_id == user_id, WalletLedger.id > since)
+    ).scalar_one()
+    return (snapshot.balance_minor if snapshot else 0) + delta
+
+def _snapshot_wallets():
+    """Snapshot every wallet with ledger entries since its last snapshot
+    
+    Postgres can commit ledger IDs out of order, and reads only look past a
+    snapshot's ledger_id, so entries newer than WALLET_SETTLE_SECONDS are left
+    for a later snapshot: any lower ID has committed by then.
+    """
+    settled = datetime.utcnow() - timedelta(seconds=WALLET_SETTLE_SECONDS)
+    last = select(WalletSnapshot.user_id, func.max(WalletSnapshot.ledger_id).label('ledger_id'))\
+        .group_by(WalletSnapshot.user_id).subquery()
+    previous = dict(db.session.execute(
+        select(WalletSnapshot.user_id, WalletSnapshot.balance_minor)
+        .join(last, and_(WalletSnapshot.user_id == last.c.user_id,
+                         WalletSnapshot.ledger_id == last.c.ledger_id))
+    ).all())
+    pending = db.session.execute(
+        select(WalletLedger.user_id, func.sum(WalletLedger.amount_minor), func.max(WalletLedger.id))
+        .outerjoin(last, WalletLedger.user_id == last.c.user_id)
+        .where(WalletLedger.id > func.coalesce(last.c.ledger_id, 0), WalletLedger.created_at < settled)
+        .group_by(WalletLedger.user_id)
+    ).all()
+    
+    snapshots = [
+        {'user_id': user_id, 'ledger_id': ledger_id, 'balance_minor': previous.get(user_id, 0) + delta}
+        for user_id, delta, ledger_id in pending
+    ]
+    if snapshots:
+        db.session.execute(insert(WalletSnapshot), snapshots)
+    db.session.commit()
+    return snapshots
+
+# Current user
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', 5))  # seconds; bounds staleness across workers
+
+class UserCache:
+    """Short-lived user rows shared by requests, dropped when a balance changes
+    
+    Entries are plain column rows, not ORM instances, so they are safe to hand
+    to any thread or session.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rows = {}
+        self._generation = 0
+    
+    def get(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._rows.get(user_id)
+            generation = self._generation
+        if entry and entry[0] > now:
+            return entry[1]
+        
+        row = db.session.execute(
+            select(User.id, User.username, User.email, User.balance, User.created_at)
+            .where(User.id == user_id)
+        ).first()
+        with self._lock:
+            # Skip caching a row read before an invalidation landed
+            if row is not None and generation == self._generation:
+                self._rows[user_id] = (now + USER_CACHE_TTL, row)
+        return row
+    
+    def invalidate(self, user_ids=None):
+        """Drop the given users, or everyone when no IDs are given"""
+        with self._lock:
+            self._generation += 1
+            if user_ids is None:
+                self._rows.clear()
+            else:
+                for user_id in user_ids:
+                    self._rows.pop(user_id, None)
+
+user_cache = UserCache()
+
+def _mark_balance_changed(user_id=None):
+    """Invalidate a cached balance once the session commits; None means any user"""
+    changed = db.session.info.setdefault('balances_changed', set())
+    changed.add(user_id)
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_user_cache(session):
+    changed = session.info.pop('balances_changed', None)
+    if changed:
+        user_cache.invalidate(None if None in changed else changed)
+
+@jwt.user_lookup_loader
+def _load_current_user(jwt_header, jwt_data):
+    # flask_jwt_extended keeps the result for the rest of the request
+    return user_cache.get(jwt_data['sub'])
+
+@jwt.user_lookup_error_loader
+def _current_user_missing(jwt_header, jwt_data):
+    return jsonify({'error': 'User not found'}), 404
+
 # Authentication Routes
 @app.route('/api/register', methods=['POST'])
 def register():
@@ -180,6 +844,8 @@ def register():
         user.set_password(data['password'])
         
         db.session.add(user)
+        db.session.flush()
+        _open_wallet(user)
         db.session.commit()
         
         # Create access token
@@ -208,6 +874,10 @@ def login():
         ).first()
         
         if user and user.check_password(data['password']):
+            if user.password_needs_rehash():
+                # The password is only in hand at login, so upgrade the hash now
+                user.set_password(data['password'])
+                db.session.commit()
             access_token = create_access_token(identity=user.id)
             return jsonify({
                 'message': 'Login successful',
@@ -225,27 +895,27 @@ def login():
 @jwt_required()
 def dashboard():
     try:
-        user_id = get_jwt_identity()
-        user = User.query.get(user_id)
-        
-        if not user:
-            return jsonify({'error': 'User not found'}), 404
+        user = current_user
+        user_id = user.id
         
         # Get recent matka bets
-        recent_bets = MatkaBet.query.filter_by(user_id=user_id).order_by(MatkaBet.created_at.desc()).limit(10).all()
+        recent_bets = db.session.execute(
+            _column_rows(MatkaBet).where(MatkaBet.user_id == user_id)
+            .order_by(MatkaBet.created_at.desc()).limit(10)
+        )
         
         # Get active matka markets
-        active_markets = MatkaMarket.query.filter_by(is_active=True).all()
+        active_markets = market_schedule.markets()
         
         # Get today's results
         from datetime import date
-        today_results = MatkaResult.query.filter_by(date=date.today()).all()
+        today_results = db.session.execute(_column_rows(MatkaResult).where(MatkaResult.date == date.today()))
         
         return jsonify({
-            'user': user.to_dict(),
-            'recent_bets': [bet.to_dict() for bet in recent_bets],
-            'active_markets': [market.to_dict() for market in active_markets],
-            'today_results': [result.to_dict() for result in today_results]
+            'user': User.to_dict(user),
+            'recent_bets': [MatkaBet.to_dict(bet) for bet in recent_bets],
+            'active_markets': active_markets,
+            'today_results': [MatkaResult.to_dict(result) for result in today_results]
         }), 200
         
     except Exception as e:
@@ -253,112 +923,540 @@ def dashboard():
 
 # Matka API Routes
 @app.route('/api/matka/markets', methods=['GET'])
+@conditional_public
 def get_matka_markets():
     # This endpoint is now public - no authentication required
     try:
-        markets = MatkaMarket.query.filter_by(is_active=True).all()
         return jsonify({
-            'markets': [market.to_dict() for market in markets]
+            'markets': market_schedule.markets()
         }), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Payout rates by bet type
+MATKA_RATES = {  # one rate per BET_TYPE_CODES entry
+    'single': 9.5,
+    'jodi': 95.0,
+    'single_panna': 142.0,
+    'double_panna': 285.0,
+    'triple_panna': 950.0,
+    'half_sangam': 1425.0,
+    'full_sangam': 9500.0
+}
+
+MAX_BETS_PER_BATCH = 100
+
+def _parse_matka_bet(data):
+    """Read one bet from a request payload, returning (fields, codes, error)
+    
+    fields are MatkaBet columns; codes are what the bet is indexed and limited under.
+    """
+    try:
+        amount = float(data.get('amount', 0))
+    except (TypeError, ValueError):
+        amount = 0
+    
+    if amount <= 0:
+        return None, None, 'Invalid bet amount'
+    
+    try:
+        market_id = int(data.get('market_id'))
+    except (TypeError, ValueError):
+        return None, None, 'Invalid market'
+    
+    # Both sessions take bets between the market's open_time and close_time
+    session = data.get('session', 'open')  # open or close
+    if not market_schedule.accepts_bets(market_id, session):
+        return None, None, 'Market is closed for betting'
+    
+    bet_type = data.get('bet_type')
+    try:
+        numbers, codes = _parse_numbers(bet_type, data.get('numbers'), session)  # "1,2,3" or "12,23"
+    except ValueError as e:
+        return None, None, str(e)
+    
+    return {
+        'market_id': market_id,
+        'bet_type': bet_type,
+        'numbers': numbers,
+        'amount': amount,
+        'rate': MATKA_RATES[bet_type],
+        'session': session
+    }, codes, None
+
+# Exposure
+# Limits per market and date; 0 turns a limit off
+MAX_OUTCOME_PAYOUT = float(os.environ.get('MATKA_MAX_OUTCOME_PAYOUT', 0))  # owed on any one drawn outcome
+MAX_MARKET_STAKE = float(os.environ.get('MATKA_MAX_MARKET_STAKE', 0))
+MAX_USER_STAKE = float(os.environ.get('MATKA_MAX_USER_STAKE', 0))  # per user
+
+class ExposureLimitExceeded(Exception):
+    pass
+
+BET_SETTLE_SECONDS = 60  # longest a bet transaction stays open after its ID is assigned
+
+class _MarketExposure:
+    def __init__(self):
+        self.liability = {}  # bet code -> payout owed if that outcome is drawn
+        self.stake = 0.0
+        self.user_stake = {}
+        self.last_bet_id = 0  # every committed bet up to this ID is counted
+        self.counted = set()  # IDs past last_bet_id counted already
+        self.checkpoints = deque()  # (monotonic time, highest bet ID a catch-up saw then)
+        self.loaded = False
+        self.ready = threading.Event()
+
+class _Reservation:
+    def __init__(self, book, user_id, codes, amount, payout):
+        self.book = book
+        self.user_id = user_id
+        self.codes = codes
+        self.amount = amount
+        self.payout = payout
+
+class ExposureBook:
+    """Stake and worst-case payout per outcome for each market and date, kept in memory
+    
+    Placements reserve against the running totals under one lock, so concurrent
+    bets cannot overshoot a limit, then confirm once committed or release on
+    failure. Only the first bet on a market and date reads the database; later
+    exposure reads fold in bets placed by other workers from the key index.
+    Database reads run outside the lock and are merged under it.
+    
+    IDs are assigned when a bet is inserted but become visible when it commits,
+    which on Postgres need not be in ID order. Catch-ups therefore keep reading
+    from a watermark that only passes an ID once BET_SETTLE_SECONDS have gone by
+    since a catch-up first saw it, remembering the IDs counted beyond it.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._books = {}
+    
+    def reserve(self, user_id, fields, codes, day):
+        """Hold a bet's stake and payout against the limits, raising ExposureLimitExceeded"""
+        book = self._book(fields['market_id'], day)
+        reservation = _Reservation(book, user_id, codes, fields['amount'], fields['amount'] * fields['rate'])
+        with self._lock:
+            if MAX_MARKET_STAKE and book.stake + reservation.amount > MAX_MARKET_STAKE:
+                raise ExposureLimitExceeded('Market stake limit reached')
+            if MAX_USER_STAKE and book.user_stake.get(user_id, 0.0) + reservation.amount > MAX_USER_STAKE:
+                raise ExposureLimitExceeded('Your stake limit for this market is reached')
+            for code in codes:
+                if MAX_OUTCOME_PAYOUT and book.liability.get(code, 0.0) + reservation.payout > MAX_OUTCOME_PAYOUT:
+                    raise ExposureLimitExceeded(f'Bet limit reached for {_describe_bet_code(code)}')
+            self._apply(book, reservation, 1)
+        return reservation
+    
+    def release(self, reservation):
+        """Return a reservation whose bet was not placed"""
+        with self._lock:
+            self._apply(reservation.book, reservation, -1)
+    
+    def confirm(self, reservation, bet_id):
+        """Keep a reservation as the committed bet it became"""
+        book = reservation.book
+        with self._lock:
+            if bet_id <= book.last_bet_id or bet_id in book.counted:
+                self._apply(book, reservation, -1)  # a catch-up already counted the committed row
+            else:
+                book.counted.add(bet_id)
+    
+    def liabilities(self, market_id, day):
+        """Payout owed per outcome code and total stake for a market and date"""
+        if day == date.today():
+            book = self._book(market_id, day)
+        else:
+            book = _MarketExposure()  # other days take no bets here, so read them without keeping a book
+        self._catch_up(book, market_id, day)
+        with self._lock:
+            return dict(book.liability), book.stake
+    
+    def _book(self, market_id, day):
+        """The book for a market and date, read from the database the first time it is used"""
+        while True:
+            with self._lock:
+                book = self._books.get((market_id, day))
+                loading = book is None
+                if loading:
+                    # Books for earlier days are finished with; reservations still out hold their own reference
+                    for key in [key for key in self._books if key[1] < date.today()]:
+                        del self._books[key]
+                    book = self._books[(market_id, day)] = _MarketExposure()
+            if loading:
+                try:
+                    self._catch_up(book, market_id, day)
+                    book.loaded = True
+                except Exception:
+                    with self._lock:
+                        self._books.pop((market_id, day), None)
+                    raise
+                finally:
+                    book.ready.set()
+            book.ready.wait()
+            if book.loaded:
+                return book
+    
+    @staticmethod
+    def _apply(book, reservation, sign):
+        book.stake += sign * reservation.amount
+        book.user_stake[reservation.user_id] = book.user_stake.get(reservation.user_id, 0.0) + sign * reservation.amount
+        for code in reservation.codes:
+            book.liability[code] = book.liability.get(code, 0.0) + sign * reservation.payout
+    
+    def _catch_up(self, book, market_id, day):
+        with self._lock:
+            since = book.last_bet_id
+        started = time.monotonic()
+        rows = db.session.execute(
+            select(MatkaBetCode.bet_id, MatkaBetCode.code, MatkaBet.user_id, MatkaBet.amount, MatkaBet.rate)
+            .join(MatkaBet, MatkaBet.id == MatkaBetCode.bet_id)
+            .where(MatkaBetCode.market_id == market_id, MatkaBetCode.date == day,
+                   MatkaBetCode.bet_id > since)
+            .order_by(MatkaBetCode.bet_id)
+        ).all()
+        
+        with self._lock:
+            current = None
+            for bet_id, code, user_id, amount, rate in rows:
+                if bet_id != current:  # one row per code; count the stake once per bet
+                    current = bet_id
+                    new = bet_id > book.last_bet_id and bet_id not in book.counted
+                    if new:
+                        book.counted.add(bet_id)
+                        book.stake += amount
+                        book.user_stake[user_id] = book.user_stake.get(user_id, 0.0) + amount
+                if new:
+                    book.liability[code] = book.liability.get(code, 0.0) + amount * rate
+            if rows and (not book.checkpoints or rows[-1].bet_id > book.checkpoints[-1][1]):
+                book.checkpoints.append((started, rows[-1].bet_id))
+            # Anything still uncommitted when an older checkpoint was taken has committed by now
+            while book.checkpoints and started - book.checkpoints[0][0] >= BET_SETTLE_SECONDS:
+                book.last_bet_id = max(book.last_bet_id, book.checkpoints.popleft()[1])
+            book.counted = {bet_id for bet_id in book.counted if bet_id > book.last_bet_id}
+
+exposure_book = ExposureBook()
+
+def _operator_permitted():
+    """Whether the request carries the operator key"""
+    operator_key = app.config['EXPORT_API_KEY']
+    return bool(operator_key) and hmac.compare_digest(request.headers.get('X-Export-Key', ''), operator_key)
+
+@app.route('/api/matka/exposure/<int:market_id>', methods=['GET'])
+def get_matka_exposure(market_id):
+    """Payout owed per outcome for a market's bets on ?date= (default today)"""
+    if not _operator_permitted():
+        return jsonify({'error': 'Exposure not permitted'}), 403
+    
+    try:
+        day = _parse_day(request.args.get('date')) or date.today()
+    except ValueError:
+        return jsonify({'error': 'Invalid date'}), 400
+    
+    try:
+        liability, stake = exposure_book.liabilities(market_id, day)
+        worst = max(liability.items(), key=lambda item: item[1], default=(None, 0.0))
+        return jsonify({
+            'market_id': market_id,
+            'date': day.isoformat(),
+            'stake': stake,
+            'liability': {_describe_bet_code(code): payout for code, payout in liability.items()},
+            'max_liability': {
+                'key': _describe_bet_code(worst[0]) if worst[0] else None,
+                'payout': worst[1]
+            }
+        }), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Bet ingestion
+BET_GROUP_COMMIT_MS = float(os.environ.get('BET_GROUP_COMMIT_MS', 2))  # how long a group waits for company
+BET_GROUP_COMMIT_MAX = int(os.environ.get('BET_GROUP_COMMIT_MAX', 200))
+BET_CONFIRM_TIMEOUT = 30  # seconds
+
+class BetConfirmationTimeout(Exception):
+    pass
+
+class _QueuedBet:
+    def __init__(self, user_id, fields, codes):
+        self.user_id = user_id
+        self.fields = fields
+        self.codes = codes
+        self.done = threading.Event()
+        self.claimed = False  # taken by the writer; from here on it commits or fails, never silently
+        self.cancelled = False  # given up by its caller before the writer took it
+        self.bet = None
+        self.new_balance = None
+        self.error = None
+
+def _write_bets(batch):
+    """Insert queued bets in one transaction, returning (bet, new_balance, error) for each"""
+    outcomes = []
+    for item in batch:
+        try:
+            new_balance = _debit_wallet(item.user_id, item.fields['amount'])
+        except InsufficientBalance as e:
+            outcomes.append((None, None, e))
+            continue
+        bet = MatkaBet(user_id=item.user_id, date=date.today(), **item.fields)
+        db.session.add(bet)
+        outcomes.append((bet, new_balance, None))
+    db.session.flush()
+    
+    placed = []
+    for item, (bet, new_balance, error) in zip(batch, outcomes):
+        if bet:
+            _add_bet_codes(bet, item.codes)
+            _record_ledger(bet.user_id, -bet.amount, 'matka_bet', bet.id)
+        placed.append((bet.to_dict() if bet else None, new_balance, error))
+    db.session.commit()
+    return placed
+
+class BetIngestor:
+    """Queue matka bets and write them in group commits from one writer thread
+    
+    Callers block until the commit holding their bet is durable, so a confirmed
+    bet ID is never lost. A caller that gives up waiting cancels its bet unless
+    the writer has already taken it, in which case it waits for that commit.
+    The conditional debit at write time is the only balance check, so a credit
+    committed by another process is honoured straight away.
+    """
+    
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._writer = None
+    
+    def submit(self, user_id, fields, codes):
+        """Queue a bet and wait for its commit, returning (bet dict, new balance)"""
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._run, daemon=True)
+                self._writer.start()
+        
+        item = _QueuedBet(user_id, fields, codes)
+        self._queue.put(item)
+        if not item.done.wait(BET_CONFIRM_TIMEOUT):
+            with self._lock:
+                item.cancelled = not item.claimed
+            if item.cancelled:
+                raise BetConfirmationTimeout()  # the writer will skip it, so nothing was debited
+            item.done.wait()  # already in a commit; report how that commit ends
+        
+        if item.error:
+            raise item.error
+        return item.bet, item.new_balance
+    
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + BET_GROUP_COMMIT_MS / 1000
+            while len(batch) < BET_GROUP_COMMIT_MAX:
+                try:
+                    batch.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            
+            with self._lock:
+                batch = [item for item in batch if not item.cancelled]
+                for item in batch:
+                    item.claimed = True
+            if not batch:
+                continue
+            
+            try:
+                with app.app_context():
+                    self._commit(batch)
+            except Exception as e:
+                for item in batch:
+                    item.error = item.error or e
+            for item in batch:
+                item.done.set()
+    
+    def _commit(self, batch):
+        try:
+            outcomes = _with_busy_retry(lambda: _write_bets(batch))
+        except Exception as e:
+            db.session.rollback()
+            if len(batch) == 1:
+                batch[0].error = e
+                return
+            # Commit the rest of the group without the bet that broke it
+            for item in batch:
+                self._commit([item])
+            return
+        
+        for item, (bet, new_balance, error) in zip(batch, outcomes):
+            item.bet, item.new_balance, item.error = bet, new_balance, error
+
+bet_ingestor = BetIngestor()
+
 @app.route('/api/matka/place_bet', methods=['POST'])
 @jwt_required()
 def place_matka_bet():
     try:
-        user_id = get_jwt_identity()
-        user = User.query.get(user_id)
+        user = current_user
         data = request.get_json()
         
-        if not user:
-            return jsonify({'error': 'User not found'}), 404
+        fields, codes, error = _parse_matka_bet(data)
+        if error:
+            return jsonify({'error': error}), 400
         
-        market_id = data.get('market_id')
-        bet_type = data.get('bet_type')  # single, jodi, panna, sangam
-        numbers = data.get('numbers')  # "1,2,3" or "12,23"
-        amount = float(data.get('amount', 0))
-        session = data.get('session', 'open')  # open or close
+        try:
+            reservation = exposure_book.reserve(user.id, fields, codes, date.today())
+        except ExposureLimitExceeded as e:
+            return jsonify({'error': str(e)}), 400
         
-        if amount <= 0:
-            return jsonify({'error': 'Invalid bet amount'}), 400
+        try:
+            bet, new_balance = bet_ingestor.submit(user.id, fields, codes)
+        except Exception as e:
+            exposure_book.release(reservation)
+            if isinstance(e, InsufficientBalance):
+                return jsonify({'error': 'Insufficient balance'}), 400
+            if isinstance(e, BetConfirmationTimeout):
+                return jsonify({'error': 'Bet confirmation timed out; the bet was not placed'}), 504
+            raise
+        exposure_book.confirm(reservation, bet['id'])
         
-        if amount > user.balance:
-            return jsonify({'error': 'Insufficient balance'}), 400
+        return jsonify({
+            'message': 'Bet placed successfully',
+            'bet': bet,
+            'new_balance': new_balance
+        }), 201
         
-        # Get rates based on bet type
-        rates = {
-            'single': 9.5,
-            'jodi': 95.0,
-            'single_panna': 142.0,
-            'double_panna': 285.0,
-            'triple_panna': 950.0,
-            'half_sangam': 1425.0,
-            'full_sangam': 9500.0
-        }
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/matka/place_bets', methods=['POST'])
+@jwt_required()
+def place_matka_bets():
+    """Place a list of bets with one balance check, one insert and one debit"""
+    try:
+        user = current_user
+        user_id = user.id
+        data = request.get_json()
         
-        rate = rates.get(bet_type, 9.5)
+        items = data.get('bets') if data else None
+        if not isinstance(items, list) or not items:
+            return jsonify({'error': 'No bets provided'}), 400
         
-        # Create new bet
-        from datetime import date
-        new_bet = MatkaBet(
-            user_id=user_id,
-            market_id=market_id,
-            bet_type=bet_type,
-            numbers=numbers,
-            amount=amount,
-            rate=rate,
-            date=date.today(),
-            session=session
-        )
+        if len(items) > MAX_BETS_PER_BATCH:
+            return jsonify({'error': f'At most {MAX_BETS_PER_BATCH} bets per request'}), 400
         
-        # Deduct amount from user balance
-        user.balance -= amount
+        # Validate every item against a single balance read; the cached user row may be stale
+        results = [None] * len(items)
+        accepted = []
+        available = db.session.execute(select(User.balance).where(User.id == user_id)).scalar_one()
+        today = date.today()
+        try:
+            for index, item in enumerate(items):
+                fields, codes, error = _parse_matka_bet(item if isinstance(item, dict) else {})
+                if not error and fields['amount'] > available:
+                    error = 'Insufficient balance'
+                if not error:
+                    try:
+                        reservation = exposure_book.reserve(user_id, fields, codes, today)
+                    except ExposureLimitExceeded as e:
+                        error = str(e)
+                if error:
+                    results[index] = {'index': index, 'status': 'rejected', 'error': error}
+                    continue
+                available -= fields['amount']
+                accepted.append((index, fields, codes, reservation))
+        except Exception:
+            for _, _, _, reservation in accepted:
+                exposure_book.release(reservation)
+            raise
         
-        db.session.add(new_bet)
-        db.session.commit()
+        if not accepted:
+            return jsonify({'error': 'No valid bets', 'results': results}), 400
+        
+        def place():
+            new_balance = _debit_wallet(user_id, sum(fields['amount'] for _, fields, _, _ in accepted))
+            
+            now = datetime.utcnow()
+            rows = [
+                dict(fields, user_id=user_id, date=today, status='pending', win_amount=0.0, created_at=now)
+                for _, fields, _, _ in accepted
+            ]
+            bet_ids = db.session.execute(
+                insert(MatkaBet).returning(MatkaBet.id, sort_by_parameter_order=True), rows
+            ).scalars().all()
+            
+            code_rows = []
+            ledger_rows = []
+            for bet_id, row, (_, _, codes, _) in zip(bet_ids, rows, accepted):
+                row['id'] = bet_id
+                code_rows.extend(
+                    {'bet_id': bet_id, 'market_id': row['market_id'], 'date': row['date'], 'code': code}
+                    for code in codes
+                )
+                ledger_rows.append({
+                    'user_id': user_id, 'amount_minor': -_to_minor(row['amount']),
+                    'kind': 'matka_bet', 'ref_id': bet_id, 'created_at': now
+                })
+            db.session.execute(insert(MatkaBetCode), code_rows)
+            db.session.execute(insert(WalletLedger), ledger_rows)
+            db.session.commit()
+            return rows, new_balance
+        
+        try:
+            rows, new_balance = _with_busy_retry(place)
+        except Exception as e:
+            for _, _, _, reservation in accepted:
+                exposure_book.release(reservation)
+            if isinstance(e, InsufficientBalance):
+                return jsonify({'error': 'Insufficient balance'}), 400
+            raise
+        
+        for (index, _, _, reservation), row in zip(accepted, rows):
+            exposure_book.confirm(reservation, row['id'])
+            results[index] = {'index': index, 'status': 'placed', 'bet': MatkaBet(**row).to_dict()}
         
         return jsonify({
-            'message': 'Bet placed successfully',
-            'bet': new_bet.to_dict(),
-            'new_balance': user.balance
+            'message': f'{len(rows)} of {len(items)} bets placed',
+            'results': results,
+            'new_balance': new_balance
         }), 201
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/matka/results', methods=['GET'])
+@conditional_public
 def get_matka_results():
     try:
         # Get today's results for all markets
         from datetime import date
-        today_results = MatkaResult.query.filter_by(date=date.today()).all()
+        today_results = db.session.execute(_column_rows(MatkaResult).where(MatkaResult.date == date.today()))
         
         return jsonify({
-            'results': [result.to_dict() for result in today_results]
+            'results': [MatkaResult.to_dict(result) for result in today_results]
         }), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/matka/live-data', methods=['GET'])
+@conditional_public
 def get_matka_live_data():
     try:
         # Get all active markets with their current status
-        markets = MatkaMarket.query.filter_by(is_active=True).all()
+        markets = market_schedule.markets()
+        
+        # Get today's declared results for every market in one query
+        from datetime import date
+        today_results = {
+            result.market_id: MatkaResult.to_dict(result)
+            for result in db.session.execute(
+                _column_rows(MatkaResult).where(MatkaResult.date == date.today(), MatkaResult.is_declared == True)
+            )
+        }
         
         live_data = []
         for market in markets:
-            # Get today's result if declared
-            from datetime import date
-            today_result = MatkaResult.query.filter_by(
-                market_id=market.id, 
-                date=date.today(),
-                is_declared=True
-            ).first()
-            
-            market_data = market.to_dict()
-            market_data['today_result'] = today_result.to_dict() if today_result else None
+            market_data = dict(market)
+            market_data['today_result'] = today_results.get(market['id'])
             live_data.append(market_data)
         
         return jsonify({
@@ -368,15 +1466,45 @@ def get_matka_live_data():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/matka/stream', methods=['GET'])
+def stream_matka_live():
+    """Server-Sent Events feed of market status changes and declared results"""
+    try:
+        _ensure_status_publisher()
+        snapshot = _sse_message('markets', market_schedule.markets())
+        subscriber = live_broker.subscribe()
+        
+        def events():
+            try:
+                yield snapshot
+                while True:
+                    try:
+                        yield subscriber.get(timeout=LIVE_KEEPALIVE)
+                    except queue.Empty:
+                        yield ': keepalive\n\n'
+            finally:
+                live_broker.unsubscribe(subscriber)
+        
+        return Response(events(), mimetype='text/event-stream', headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        })
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/matka/declare_result', methods=['POST'])
 def declare_matka_result():
     try:
         data = request.get_json()
         
         market_id = data.get('market_id')
-        open_pana = data.get('open_pana')
-        close_pana = data.get('close_pana')
         result_date = data.get('date')
+        try:
+            open_pana = _canonical_panna(data.get('open_pana'))
+            close_pana = _canonical_panna(data.get('close_pana'))
+        except ValueError:
+            return jsonify({'error': 'Invalid pana'}), 400
         
         from datetime import datetime
         date_obj = datetime.strptime(result_date, '%Y-%m-%d').date()
@@ -385,6 +1513,7 @@ def declare_matka_result():
         open_ank = sum(int(d) for d in open_pana) % 10
         close_ank = sum(int(d) for d in close_pana) % 10
         jodi = f"{open_ank}{close_ank}"
+        winning_codes = _winning_codes(open_pana, close_pana, open_ank, close_ank)
         
         # Check if result already exists
         existing_result = MatkaResult.query.filter_by(market_id=market_id, date=date_obj).first()
@@ -414,87 +1543,114 @@ def declare_matka_result():
             db.session.add(new_result)
         
         # Process winning bets
-        _process_winning_bets(market_id, date_obj, open_pana, close_pana, open_ank, close_ank, jodi)
+        _process_winning_bets(market_id, date_obj, winning_codes)
         
         db.session.commit()
         
+        live_broker.publish('result', (existing_result or new_result).to_dict())
+        
         return jsonify({'message': 'Result declared successfully'}), 201
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-def _process_winning_bets(market_id, date_obj, open_pana, close_pana, open_ank, close_ank, jodi):
-    """Process and update winning bets"""
-    bets = MatkaBet.query.filter_by(market_id=market_id, date=date_obj, status='pending').all()
-    
-    for bet in bets:
-        is_winner = False
-        
-        if bet.bet_type == 'single':
-            # Check if bet number matches open or close ank
-            bet_numbers = bet.numbers.split(',')
-            if bet.session == 'open' and str(open_ank) in bet_numbers:
-                is_winner = True
-            elif bet.session == 'close' and str(close_ank) in bet_numbers:
-                is_winner = True
-        
-        elif bet.bet_type == 'jodi':
-            if bet.numbers == jodi:
-                is_winner = True
-        
-        elif bet.bet_type == 'single_panna':
-            if bet.session == 'open' and bet.numbers == open_pana:
-                is_winner = True
-            elif bet.session == 'close' and bet.numbers == close_pana:
-                is_winner = True
-        
-        if is_winner:
-            bet.status = 'won'
-            bet.win_amount = bet.amount * bet.rate
-            
-            # Add winnings to user balance
-            user = User.query.get(bet.user_id)
-            user.balance += bet.win_amount
-        else:
-            bet.status = 'lost'
+def _process_winning_bets(market_id, date_obj, winning_codes):
+    """Settle every pending bet for the market/date with set-based updates
+    
+    Winning is decided by integer codes alone, so every bet type in MATKA_RATES
+    settles through the same indexed probe of the declared result's codes.
+    """
+    pending = and_(
+        MatkaBet.market_id == market_id,
+        MatkaBet.date == date_obj,
+        MatkaBet.status == 'pending'
+    )
+    
+    # A bet wins when any of its number codes is in the declared winning set
+    is_winner = MatkaBet.id.in_(
+        select(MatkaBetCode.bet_id).where(
+            MatkaBetCode.market_id == market_id,
+            MatkaBetCode.date == date_obj,
+            MatkaBetCode.code.in_(winning_codes)
+        )
+    )
+    winners = and_(pending, is_winner)
+    
+    # One ledger credit per winning bet
+    db.session.execute(
+        insert(WalletLedger).from_select(
+            ['user_id', 'amount_minor', 'kind', 'ref_id', 'created_at'],
+            select(
+                MatkaBet.user_id,
+                cast(func.round(MatkaBet.amount * MatkaBet.rate * 100), Integer),
+                literal('win'),
+                MatkaBet.id,
+                literal(datetime.utcnow())
+            ).where(winners)
+        )
+    )
+    
+    # Credit each winning user once, aggregating the winners in one pass (UPDATE ... FROM)
+    _mark_balance_changed()
+    winnings = select(MatkaBet.user_id, func.sum(MatkaBet.amount * MatkaBet.rate).label('total'))\
+        .where(winners)\
+        .group_by(MatkaBet.user_id)\
+        .subquery()
+    db.session.execute(
+        update(User)
+        .where(User.id == winnings.c.user_id)
+        .values(balance=User.balance + winnings.c.total)
+        .execution_options(synchronize_session=False)
+    )
+    
+    # Decide every pending bet in one pass; the winning-code probe is built once per statement
+    db.session.execute(
+        update(MatkaBet)
+        .where(pending)
+        .values(
+            status=case((is_winner, 'won'), else_='lost'),
+            win_amount=case((is_winner, MatkaBet.amount * MatkaBet.rate), else_=0.0)
+        )
+        .execution_options(synchronize_session=False)
+    )
 
 @app.route('/api/place_bet', methods=['POST'])
 @jwt_required()
 def place_bet():
     try:
-        user_id = get_jwt_identity()
-        user = User.query.get(user_id)
+        user_id = current_user.id
         data = request.get_json()
         
-        if not user:
-            return jsonify({'error': 'User not found'}), 404
-        
         bet_amount = float(data.get('amount', 0))
         if bet_amount <= 0:
             return jsonify({'error': 'Invalid bet amount'}), 400
         
-        if bet_amount > user.balance:
-            return jsonify({'error': 'Insufficient balance'}), 400
-        
-        # Create new bet
-        new_bet = BetHistory(
-            user_id=user_id,
-            match_name=data.get('match_name', ''),
-            bet_amount=bet_amount,
-            bet_type=data.get('bet_type', ''),
-            odds=float(data.get('odds', 1.0))
-        )
-        
-        # Deduct amount from user balance
-        user.balance -= bet_amount
+        def place():
+            # Deduct amount from user balance
+            new_balance = _debit_wallet(user_id, bet_amount)
+            
+            new_bet = BetHistory(
+                user_id=user_id,
+                match_name=data.get('match_name', ''),
+                bet_amount=bet_amount,
+                bet_type=data.get('bet_type', ''),
+                odds=float(data.get('odds', 1.0))
+            )
+            db.session.add(new_bet)
+            db.session.flush()
+            _record_ledger(user_id, -bet_amount, 'bet', new_bet.id)
+            db.session.commit()
+            return new_bet, new_balance
         
-        db.session.add(new_bet)
-        db.session.commit()
+        try:
+            new_bet, new_balance = _with_busy_retry(place)
+        except InsufficientBalance:
+            return jsonify({'error': 'Insufficient balance'}), 400
         
         return jsonify({
             'message': 'Bet placed successfully',
             'bet': new_bet.to_dict(),
-            'new_balance': user.balance
+            'new_balance': new_balance
         }), 201
         
     except Exception as e:
@@ -504,36 +1660,376 @@ def place_bet():
 @jwt_required()
 def get_profile():
     try:
-        user_id = get_jwt_identity()
-        user = User.query.get(user_id)
-        
-        if not user:
-            return jsonify({'error': 'User not found'}), 404
-        
-        return jsonify({'user': user.to_dict()}), 200
+        return jsonify({'user': User.to_dict(current_user)}), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Bet history
+HISTORY_PAGE_SIZE = 20
+HISTORY_MAX_PAGE_SIZE = 100
+HISTORY_STATUSES = ('pending', 'won', 'lost')
+
+def _encode_cursor(row):
+    return base64.urlsafe_b64encode(f'{row.created_at.isoformat()}|{row.id}'.encode()).decode()
+
+def _decode_cursor(cursor):
+    try:
+        created_at, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError('Invalid cursor')
+
+def _history_conditions(model, day_column):
+    """Filters shared by the history endpoints; raises ValueError on bad input"""
+    args = request.args
+    conditions = [model.user_id == get_jwt_identity()]
+    
+    if args.get('cursor'):
+        created_at, row_id = _decode_cursor(args['cursor'])
+        conditions.append(tuple_(model.created_at, model.id) < tuple_(created_at, row_id))
+    
+    if args.get('status'):
+        if args['status'] not in HISTORY_STATUSES:
+            raise ValueError('Invalid status')
+        conditions.append(model.status == args['status'])
+    
+    # Inclusive YYYY-MM-DD bounds; day_column turns a column into its calendar day
+    if args.get('from'):
+        conditions.append(day_column >= datetime.strptime(args['from'], '%Y-%m-%d').date())
+    if args.get('to'):
+        conditions.append(day_column <= datetime.strptime(args['to'], '%Y-%m-%d').date())
+    return conditions
+
+def _stream_history(model, conditions):
+    """Stream one keyset page as JSON, newest first"""
+    limit = max(1, min(request.args.get('limit', HISTORY_PAGE_SIZE, type=int), HISTORY_MAX_PAGE_SIZE))
+    statement = _column_rows(model).where(*conditions)\
+        .order_by(model.created_at.desc(), model.id.desc())\
+        .limit(limit + 1)
+    
+    def generate():
+        result = db.session.execute(statement.execution_options(yield_per=50))
+        last, next_cursor = None, None
+        try:
+            yield '{"bets": ['
+            for count, row in enumerate(result):
+                if count == limit:
+                    next_cursor = _encode_cursor(last)
+                    break
+                yield (',' if count else '') + app.json.dumps(model.to_dict(row))
+                last = row
+            yield f'], "next_cursor": {json.dumps(next_cursor)}}}'
+        finally:
+            result.close()
+    
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+@app.route('/api/matka/bets', methods=['GET'])
+@jwt_required()
+def get_matka_bet_history():
+    """Page through the user's matka bets with ?cursor=, market_id, status, from and to"""
+    try:
+        conditions = _history_conditions(MatkaBet, MatkaBet.date)
+        if request.args.get('market_id'):
+            conditions.append(MatkaBet.market_id == int(request.args['market_id']))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        return _stream_history(MatkaBet, conditions)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/bets', methods=['GET'])
+@jwt_required()
+def get_bet_history():
+    """Page through the user's bets with ?cursor=, status, from and to"""
+    try:
+        conditions = _history_conditions(BetHistory, func.date(BetHistory.created_at))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        return _stream_history(BetHistory, conditions)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Reconciliation exports
+EXPORT_BATCH_SIZE = 1000
+EXPORT_FORMATS = ('ndjson', 'csv')
+
+def _export_tables():
+    """Exportable tables with the column their date range applies to"""
+    return {
+        'matka_bets': (MatkaBet, MatkaBet.date),
+        'bets': (BetHistory, BetHistory.created_at),
+        'results': (MatkaResult, MatkaResult.date)
+    }
+
+def _export_statement(table, date_from=None, date_to=None, market_id=None):
+    """Column-tuple select for an export; raises ValueError on bad filters"""
+    if table not in _export_tables():
+        raise ValueError(f'Unknown export table: {table}')
+    model, day_column = _export_tables()[table]
+    statement = select(*model.__table__.columns).order_by(model.id)
+    
+    # Inclusive dates; datetime columns are bounded by the following midnight
+    if date_from:
+        statement = statement.where(day_column >= date_from)
+    if date_to:
+        if isinstance(day_column.type, db.DateTime):
+            statement = statement.where(day_column < datetime.combine(date_to + timedelta(days=1), datetime.min.time()))
+        else:
+            statement = statement.where(day_column <= date_to)
+    if market_id is not None:
+        if 'market_id' not in model.__table__.columns:
+            raise ValueError(f'{table} has no market filter')
+        statement = statement.where(model.market_id == market_id)
+    return statement
+
+def _export_value(value):
+    return value.isoformat() if isinstance(value, (date, datetime)) else value
+
+def _export_lines(statement, export_format):
+    """Yield NDJSON or CSV lines, reading rows in batches through a server-side cursor"""
+    result = db.session.execute(statement.execution_options(yield_per=EXPORT_BATCH_SIZE))
+    try:
+        if export_format == 'csv':
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(result.keys())
+            for row in result:
+                writer.writerow([_export_value(value) for value in row])
+                if buffer.tell() >= 64 * 1024:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+            yield buffer.getvalue()
+        else:
+            for row in result.mappings():
+                yield app.json.dumps({key: _export_value(value) for key, value in row.items()}) + '\n'
+    finally:
+        result.close()
+
+def _parse_day(value):
+    return datetime.strptime(value, '%Y-%m-%d').date() if value else None
+
+def _parse_market_id(value):
+    try:
+        return int(value) if value else None
+    except ValueError:
+        raise ValueError('Invalid market_id') from None
+
+@app.route('/api/export/<table>', methods=['GET'])
+def export_table(table):
+    """Stream a table as ?format=ndjson|csv with from, to and market_id filters"""
+    if not _operator_permitted():
+        return jsonify({'error': 'Export not permitted'}), 403
+    
+    export_format = request.args.get('format', 'ndjson')
+    try:
+        if export_format not in EXPORT_FORMATS:
+            raise ValueError('Invalid format')
+        statement = _export_statement(
+            table,
+            _parse_day(request.args.get('from')),
+            _parse_day(request.args.get('to')),
+            _parse_market_id(request.args.get('market_id'))
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    mimetype = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    return Response(stream_with_context(_export_lines(statement, export_format)), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename={table}.{export_format}'
+    })
+
+@app.cli.command('export')
+@click.argument('table', type=click.Choice(['matka_bets', 'bets', 'results']))
+@click.option('--format', 'export_format', type=click.Choice(EXPORT_FORMATS), default='ndjson')
+@click.option('--from', 'date_from', help='First day, YYYY-MM-DD')
+@click.option('--to', 'date_to', help='Last day, YYYY-MM-DD')
+@click.option('--market-id', type=int)
+@click.option('--output', type=click.File('w'), default='-')
+def export_command(table, export_format, date_from, date_to, market_id, output):
+    """Stream a table for reconciliation without loading it into memory"""
+    try:
+        statement = _export_statement(table, _parse_day(date_from), _parse_day(date_to), market_id)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    for chunk in _export_lines(statement, export_format):
+        output.write(chunk)
+
 # Health check endpoint
 @app.route('/api/health', methods=['GET'])
 def health_check():
     return jsonify({'status': 'healthy', 'message': 'Betting API is running'}), 200
 
-# Create database tables and demo user on startup
-with app.app_context():
+# Schema migrations
+def _column_ddl(column, dialect, change):
+    """ALTER TABLE statement adding a model column or widening it to the model's type"""
+    preparer = dialect.identifier_preparer
+    action = 'ADD COLUMN {} {}' if change == 'add' else 'ALTER COLUMN {} TYPE {}'
+    return f'ALTER TABLE {preparer.format_table(column.table)} ' \
+        + action.format(preparer.format_column(column), column.type.compile(dialect))
+
+def _migrate():
+    """Bring an existing database up to the current models"""
     db.create_all()
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        # create_all skips existing tables, so add their newer columns and indexes here
+        existing = {column['name']: column for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            current = existing.get(column.name)
+            if current is None:
+                with db.engine.begin() as connection:
+                    connection.execute(text(_column_ddl(column, db.engine.dialect, 'add')))
+            elif (db.engine.dialect.name == 'postgresql'
+                    and (getattr(current['type'], 'length', None) or 0) < (getattr(column.type, 'length', None) or 0)):
+                # SQLite ignores VARCHAR lengths; Postgres needs widened columns altered
+                with db.engine.begin() as connection:
+                    connection.execute(text(_column_ddl(column, db.engine.dialect, 'widen')))
+        for index in table.indexes:
+            try:
+                index.create(db.engine, checkfirst=True)
+            except IntegrityError as e:
+                print(f"Could not create {index.name}, existing rows violate it: {e.orig}")
+
+def _hot_queries():
+    """Representative statements for every query on a request or settlement path"""
+    today = date.today()
+    return {
+        'settlement pending bets': select(MatkaBet.id).where(
+            MatkaBet.market_id == 1, MatkaBet.date == today, MatkaBet.status == 'pending'),
+        'settlement winning codes': select(MatkaBetCode.bet_id).where(
+            MatkaBetCode.market_id == 1, MatkaBetCode.date == today,
+            MatkaBetCode.code.in_([_bet_code('jodi', 0, 12)])),
+        'dashboard recent bets': select(MatkaBet).where(MatkaBet.user_id == 1)
+            .order_by(MatkaBet.created_at.desc()).limit(10),
+        'results by date': select(MatkaResult).where(MatkaResult.date == today),
+        'result by market and date': select(MatkaResult).where(
+            MatkaResult.market_id == 1, MatkaResult.date == today),
+        'wallet ledger since snapshot': select(func.sum(WalletLedger.amount_minor)).where(
+            WalletLedger.user_id == 1, WalletLedger.id > 0),
+        'matka bet history page': select(MatkaBet).where(
+            MatkaBet.user_id == 1,
+            tuple_(MatkaBet.created_at, MatkaBet.id) < tuple_(datetime.utcnow(), 100))
+            .order_by(MatkaBet.created_at.desc(), MatkaBet.id.desc()).limit(21),
+        'bet history page': select(BetHistory).where(
+            BetHistory.user_id == 1,
+            tuple_(BetHistory.created_at, BetHistory.id) < tuple_(datetime.utcnow(), 100))
+            .order_by(BetHistory.created_at.desc(), BetHistory.id.desc()).limit(21),
+        'latest wallet snapshot': select(WalletSnapshot).where(WalletSnapshot.user_id == 1)
+            .order_by(WalletSnapshot.ledger_id.desc()).limit(1)
+    }
+
+@app.cli.command('explain-hot-queries')
+def explain_hot_queries_command():
+    """Fail if any hot query plan falls back to a full table scan (SQLite)"""
+    regressions = 0
+    for name, statement in _hot_queries().items():
+        sql = str(statement.compile(db.engine, compile_kwargs={'literal_binds': True}))
+        plan = [row[-1] for row in db.session.execute(text(f'EXPLAIN QUERY PLAN {sql}'))]
+        full_scans = [step for step in plan if step.startswith('SCAN ') and ' USING ' not in step]
+        regressions += bool(full_scans)
+        print(f"{'FULL SCAN' if full_scans else 'ok':>9}  {name}: {'; '.join(plan)}")
+    if regressions:
+        raise SystemExit(1)
+
+def _backfill_bet_codes():
+    """Canonicalize and index pending bets placed before MatkaBetCode existed"""
+    unindexed = MatkaBet.query.filter(
+        MatkaBet.status == 'pending',
+        ~exists().where(MatkaBetCode.bet_id == MatkaBet.id)
+    ).all()
+    for bet in unindexed:
+        try:
+            bet.numbers, codes = _parse_numbers(bet.bet_type, bet.numbers, bet.session)
+        except ValueError as e:
+            print(f"Bet {bet.id} cannot be indexed and will settle as lost: {e}")
+            continue
+        _add_bet_codes(bet, codes)
+    # The string keys this index replaces
+    db.session.execute(text('DROP TABLE IF EXISTS matka_bet_key'))
+    db.session.commit()
+
+def _backfill_wallet_openings():
+    """Open ledgers for users created before WalletLedger existed"""
+    db.session.execute(
+        insert(WalletLedger).from_select(
+            ['user_id', 'amount_minor', 'kind', 'created_at'],
+            select(
+                User.id,
+                cast(func.round(User.balance * 100), Integer),
+                literal('opening'),
+                literal(datetime.utcnow())
+            ).where(~exists().where(WalletLedger.user_id == User.id))
+        )
+    )
+    db.session.commit()
+
+@app.cli.command('snapshot-wallets')
+def snapshot_wallets_command():
+    """Snapshot wallet ledgers and report balances that disagree with them"""
+    snapshots = _snapshot_wallets()
+    print(f"Snapshotted {len(snapshots)} wallets")
+    for user in User.query.all():
+        ledger_balance = _ledger_balance_minor(user.id)
+        if ledger_balance != _to_minor(user.balance):
+            print(f"Balance mismatch for {user.username}: cached {user.balance}, ledger {ledger_balance / 100}")
+
+def init_db():
+    """Migrate the schema and seed the demo user; safe to run repeatedly"""
+    _migrate()
+    _ensure_data_version()
+    _backfill_bet_codes()
+    _backfill_wallet_openings()
+    
     # Create demo user if not exists
     if not User.query.filter_by(username='demo').first():
         demo_user = User(username='demo', email='demo@example.com')
         demo_user.set_password('demo123')
         db.session.add(demo_user)
+        db.session.flush()
+        _open_wallet(demo_user)
         db.session.commit()
         print("Demo user created successfully")
+    
+    db.session.merge(SchemaInfo(id=1, version=SCHEMA_VERSION))
+    db.session.commit()
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Create or migrate the database; run once per deploy"""
+    init_db()
+    print(f"Database ready at schema version {SCHEMA_VERSION}")
+
+def _schema_current():
+    if not inspect(db.engine).has_table(SchemaInfo.__tablename__):
+        return False
+    info = db.session.get(SchemaInfo, 1)
+    return info is not None and info.version >= SCHEMA_VERSION
+
+_ready = False
+_ready_lock = threading.Lock()
+
+@app.before_request
+def _ensure_ready():
+    """Check the schema once per process, migrating only if init-db was not run"""
+    global _ready
+    if _ready:
+        return
+    with _ready_lock:
+        if not _ready:
+            if not _schema_current():
+                init_db()
+            _ready = True
 
 if __name__ == '__main__':
     with app.app_context():
-        db.create_all()
+        init_db()
         
         # Add default Matka markets if they don't exist
         if MatkaMarket.query.count() == 0:
@@ -0,0 +1,19 @@
+import os
+import sys
+import tempfile
+from datetime import time
+
+import pytest
+
+# app.py reads its configuration at import time, so point it at a scratch database first
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'test.db')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(autouse=True)
+def midday(monkeypatch):
+    """Check betting windows at noon, so tests pass whatever the wall clock says"""
+    import app as betting
+    accepts_bets = betting.market_schedule.accepts_bets
+    monkeypatch.setattr(betting.market_schedule, 'accepts_bets',
+                        lambda market_id, session, now=None: accepts_bets(market_id, session, now or time(12)))
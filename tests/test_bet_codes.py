@@ -0,0 +1,79 @@
+import pytest
+
+import app as betting
+
+
+@pytest.mark.parametrize('bet_type, numbers, canonical', [
+    ('single', '0', '0'),
+    ('single', ' 7 , 3 ', '7,3'),
+    ('single', '5,5', '5'),
+    ('jodi', '00,99', '00,99'),
+    ('single_panna', '123', '123'),
+    ('single_panna', '019', '190'),
+    ('single_panna', '321', '123'),
+    ('double_panna', '121', '112'),
+    ('double_panna', '001', '100'),
+    ('triple_panna', '000,777', '000,777'),
+    ('half_sangam', '6-211', '6-112'),
+    ('half_sangam', '901-4', '190-4'),
+    ('full_sangam', '321-211', '123-112'),
+])
+def test_legal_numbers_are_canonicalized(bet_type, numbers, canonical):
+    parsed, codes = betting._parse_numbers(bet_type, numbers, 'open')
+    assert parsed == canonical
+    assert len(codes) == len(canonical.split(','))
+    assert all(betting._describe_bet_code(code).startswith(bet_type) for code in codes)
+
+
+@pytest.mark.parametrize('bet_type, numbers', [
+    ('single', '10'),
+    ('single', 'a'),
+    ('single', '٣'),
+    ('jodi', '1'),
+    ('jodi', '123'),
+    ('single_panna', '112'),
+    ('single_panna', '12'),
+    ('double_panna', '123'),
+    ('double_panna', '777'),
+    ('triple_panna', '778'),
+    ('half_sangam', '6112'),
+    ('half_sangam', '61-112'),
+    ('half_sangam', '6-12'),
+    ('full_sangam', '12-112'),
+    ('full_sangam', '123'),
+])
+def test_illegal_numbers_are_rejected(bet_type, numbers):
+    with pytest.raises(ValueError, match=f'Invalid number .* for {bet_type}'):
+        betting._parse_numbers(bet_type, numbers, 'open')
+
+
+@pytest.mark.parametrize('bet_type, numbers, message', [
+    ('lottery', '1', 'Invalid bet type'),
+    (['single'], '1', 'Invalid bet type'),
+    ('single', ' , ', 'No numbers given'),
+    ('single', None, 'No numbers given'),
+    ('jodi', ','.join(f'{n:02d}' for n in range(40)), 'Too many numbers in one bet'),
+])
+def test_malformed_bets_are_rejected(bet_type, numbers, message):
+    with pytest.raises(ValueError, match=message):
+        betting._parse_numbers(bet_type, numbers, 'open')
+
+
+def test_only_session_bet_types_depend_on_the_session():
+    for bet_type, numbers in [('single', '4'), ('single_panna', '123')]:
+        assert betting._parse_numbers(bet_type, numbers, 'open')[1] != \
+            betting._parse_numbers(bet_type, numbers, 'close')[1]
+    for bet_type, numbers in [('jodi', '45'), ('half_sangam', '6-112'), ('full_sangam', '123-112')]:
+        assert betting._parse_numbers(bet_type, numbers, 'open')[1] == \
+            betting._parse_numbers(bet_type, numbers, 'close')[1]
+
+
+def test_every_winning_code_matches_a_parsed_bet():
+    """The result 123-112 (anks 6 and 4) wins exactly these bets"""
+    winners = betting._winning_codes('123', '112', 6, 4)
+    expected = [
+        ('single', '6', 'open'), ('single', '4', 'close'), ('jodi', '64', 'open'),
+        ('single_panna', '123', 'open'), ('double_panna', '112', 'close'),
+        ('half_sangam', '6-112', 'open'), ('half_sangam', '123-4', 'open'), ('full_sangam', '123-112', 'open'),
+    ]
+    assert winners == {betting._parse_numbers(*bet)[1][0] for bet in expected}
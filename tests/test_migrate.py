@@ -0,0 +1,12 @@
+from sqlalchemy.dialects import postgresql
+
+import app as betting
+
+
+def test_column_ddl_quotes_reserved_table_names():
+    """user is reserved in Postgres, so widening its password hash must quote the table"""
+    column = betting.User.__table__.c.password_hash
+    assert betting._column_ddl(column, postgresql.dialect(), 'widen') == \
+        f'ALTER TABLE "user" ALTER COLUMN password_hash TYPE VARCHAR({column.type.length})'
+    assert betting._column_ddl(column, postgresql.dialect(), 'add') == \
+        f'ALTER TABLE "user" ADD COLUMN password_hash VARCHAR({column.type.length})'
@@ -0,0 +1,78 @@
+from datetime import date
+
+import app as betting
+
+# Result 123-112 has anks 6 and 4; result 777-000 has anks 1 and 0
+BETS = [
+    # (result, bet_type, numbers, session, wins)
+    ('123-112', 'single', '6', 'open', True),
+    ('123-112', 'single', '3,4', 'close', True),
+    ('123-112', 'single', '4', 'open', False),
+    ('123-112', 'jodi', '64', 'open', True),
+    ('123-112', 'jodi', '46', 'open', False),
+    ('123-112', 'single_panna', '321', 'open', True),
+    ('123-112', 'single_panna', '124', 'open', False),
+    ('123-112', 'double_panna', '112', 'close', True),
+    ('123-112', 'double_panna', '112', 'open', False),
+    ('123-112', 'half_sangam', '6-112', 'open', True),
+    ('123-112', 'half_sangam', '123-4', 'open', True),
+    ('123-112', 'half_sangam', '5-112', 'open', False),
+    ('123-112', 'full_sangam', '123-112', 'open', True),
+    ('123-112', 'full_sangam', '112-123', 'open', False),
+    ('777-000', 'triple_panna', '777', 'open', True),
+    ('777-000', 'triple_panna', '000', 'close', True),
+    ('777-000', 'triple_panna', '111', 'open', False),
+]
+
+
+def _user(client, name):
+    token = client.post('/api/register', json={
+        'username': name, 'email': f'{name}@example.com', 'password': f'{name}123'
+    }).get_json()['access_token']
+    return {'Authorization': f'Bearer {token}'}
+
+
+def test_declared_results_settle_every_bet_type():
+    with betting.app.app_context():
+        betting.init_db()
+        markets = {}
+        for result in ('123-112', '777-000'):
+            market = betting.MatkaMarket(name=f'Settle {result}', open_time='00:00', close_time='23:59',
+                                         result_time='23:59')
+            betting.db.session.add(market)
+            betting.db.session.commit()
+            markets[result] = market.id
+
+    client = betting.app.test_client()
+    players = {'settler': _user(client, 'settler'), 'cosettler': _user(client, 'cosettler')}
+    placed = {name: [] for name in players}
+    for name, headers in players.items():
+        bets = BETS if name == 'settler' else BETS[:4]  # a second winner on the same market
+        for result, bet_type, numbers, session, wins in bets:
+            response = client.post('/api/matka/place_bet', headers=headers, json={
+                'market_id': markets[result], 'bet_type': bet_type, 'numbers': numbers,
+                'amount': 10, 'session': session
+            })
+            assert response.status_code == 201, response.get_json()
+            placed[name].append((response.get_json()['bet']['id'], wins, 10 * betting.MATKA_RATES[bet_type]))
+
+    for result, market_id in markets.items():
+        open_pana, close_pana = result.split('-')
+        response = client.post('/api/matka/declare_result', json={
+            'market_id': market_id, 'open_pana': open_pana, 'close_pana': close_pana,
+            'date': date.today().isoformat()
+        })
+        assert response.status_code == 201
+
+    with betting.app.app_context():
+        for name, bets in placed.items():
+            user = betting.User.query.filter_by(username=name).one()
+            winnings = 0.0
+            for bet_id, wins, payout in bets:
+                bet = betting.db.session.get(betting.MatkaBet, bet_id)
+                assert (bet.status, bet.win_amount) == (('won', payout) if wins else ('lost', 0.0)), bet.to_dict()
+                winnings += payout if wins else 0.0
+            assert user.balance == 1000 - 10 * len(bets) + winnings
+            credits = betting.WalletLedger.query.filter_by(user_id=user.id, kind='win').all()
+            assert sorted(entry.ref_id for entry in credits) == sorted(bet_id for bet_id, wins, _ in bets if wins)
+            assert betting._ledger_balance_minor(user.id) == betting._to_minor(user.balance)
@@ -0,0 +1,74 @@
+import threading
+
+from sqlalchemy import create_engine, text
+
+import app as betting
+
+
+def test_concurrent_placements_never_overspend():
+    """80 mixed bets of 30 race for a 1000 balance: exactly 33 go through and 10 is left"""
+    with betting.app.app_context():
+        betting.init_db()
+        market = betting.MatkaMarket(name='Load Test', open_time='00:00', close_time='23:59', result_time='23:59')
+        betting.db.session.add(market)
+        betting.db.session.commit()
+        market_id = market.id
+        user_id = betting.User.query.filter_by(username='demo').one().id
+
+    client = betting.app.test_client()
+    token = client.post('/api/login', json={'username': 'demo', 'password': 'demo123'}).get_json()['access_token']
+    headers = {'Authorization': f'Bearer {token}'}
+
+    outcomes = []
+    def place(index):
+        if index % 2:
+            url, body = '/api/matka/place_bet', {
+                'market_id': market_id, 'bet_type': 'single', 'numbers': '1', 'amount': 30, 'session': 'open'
+            }
+        else:
+            url, body = '/api/place_bet', {'amount': 30, 'match_name': 'x', 'bet_type': 'win', 'odds': 2}
+        response = betting.app.test_client().post(url, json=body, headers=headers)
+        outcomes.append((response.status_code, response.get_json().get('error')))
+
+    threads = [threading.Thread(target=place, args=(index,)) for index in range(80)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    accepted = sum(1 for status, _ in outcomes if status == 201)
+    assert accepted == 33
+    assert all(error == 'Insufficient balance' for status, error in outcomes if status != 201)
+
+    with betting.app.app_context():
+        balance = betting.db.session.get(betting.User, user_id).balance
+        assert balance == 10.0
+        assert betting._ledger_balance_minor(user_id) == betting._to_minor(balance)
+
+
+def test_bets_see_credits_committed_elsewhere():
+    """A credit written by another process is spendable even while this process caches the old balance"""
+    with betting.app.app_context():
+        betting.init_db()
+        market = betting.MatkaMarket(name='Credit Test', open_time='00:00', close_time='23:59', result_time='23:59')
+        betting.db.session.add(market)
+        betting.db.session.commit()
+        market_id = market.id
+
+    client = betting.app.test_client()
+    token = client.post('/api/register', json={
+        'username': 'credited', 'email': 'credited@example.com', 'password': 'credited123'
+    }).get_json()['access_token']
+    headers = {'Authorization': f'Bearer {token}'}
+    assert client.get('/api/dashboard', headers=headers).status_code == 200  # caches the 1000 balance
+
+    other_process = create_engine(betting.app.config['SQLALCHEMY_DATABASE_URI'])
+    with other_process.begin() as connection:
+        connection.execute(text("UPDATE user SET balance = balance + 5000 WHERE username = 'credited'"))
+    other_process.dispose()
+
+    bet = {'market_id': market_id, 'bet_type': 'single', 'numbers': '1', 'amount': 2000, 'session': 'open'}
+    assert client.post('/api/matka/place_bet', json=bet, headers=headers).status_code == 201
+    response = client.post('/api/matka/place_bets', json={'bets': [bet]}, headers=headers)
+    assert response.status_code == 201
+    assert response.get_json()['new_balance'] == 2000.0
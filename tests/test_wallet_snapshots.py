@@ -0,0 +1,32 @@
+from datetime import datetime, timedelta
+
+import app as betting
+
+
+def _entry(user_id, amount_minor, created_at, **columns):
+    betting.db.session.add(betting.WalletLedger(
+        user_id=user_id, amount_minor=amount_minor, kind='win', created_at=created_at, **columns))
+    betting.db.session.commit()
+
+
+def test_snapshots_leave_room_for_late_commits():
+    """A ledger entry committing after a higher ID is still counted once snapshots move on"""
+    with betting.app.app_context():
+        betting.init_db()
+        user = betting.User(username='snapshotted', email='snapshotted@example.com', balance=0.0)
+        user.set_password('snapshotted123')
+        betting.db.session.add(user)
+        betting.db.session.commit()
+        user_id = user.id
+
+        settled = datetime.utcnow() - timedelta(seconds=betting.WALLET_SETTLE_SECONDS + 1)
+        _entry(user_id, 100, settled)
+        _entry(user_id, 200, datetime.utcnow(), id=10_000)  # committed while a lower ID is still open
+        betting._snapshot_wallets()
+        _entry(user_id, 300, datetime.utcnow(), id=9_000)  # the lower ID commits after the snapshot
+
+        snapshot = betting.WalletSnapshot.query.filter_by(user_id=user_id).one()
+        assert snapshot.balance_minor == 100
+        assert betting._ledger_balance_minor(user_id) == 600
+        betting._snapshot_wallets()
+        assert betting._ledger_balance_minor(user_id) == 600